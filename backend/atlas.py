@@ -0,0 +1,112 @@
+"""
+Nationwide crop-suitability atlas.
+Every state × soil type × season cell is scored in one batched predict_proba
+pass when a model version is loaded. Nutrients come from soil_profiles.json
+(per-state midpoints of soil_npk_india_dataset.csv), temperature from the
+weather table's monthly means over the season's months. Each cell is
+serialized once to an NDJSON line, so a dashboard refresh is a filtered
+stream of pre-encoded bytes instead of one request per cell.
+"""
+import datetime
+import json
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+import metrics
+import soil_compat
+
+SEASON_MONTHS = {"Kharif": (6, 7, 8, 9, 10), "Rabi": (11, 12, 1, 2, 3), "Zaid": (4, 5)}
+PROFILE_FIELDS = ("N", "P", "K", "pH", "moisture")
+DEFAULT_PROFILE = {"N": 90.0, "P": 40.0, "K": 40.0, "pH": 6.5, "moisture": 50.0}  # no soil_profiles.json
+DEFAULT_TEMPERATURE = 25.0
+
+
+class Atlas:
+    """Pre-encoded NDJSON lines, one per (state, soil type, season) cell."""
+
+    def __init__(self, built_at: datetime.datetime, cells: List[tuple]):
+        self.built_at = built_at
+        self.cells = cells   # (state, soil_type, season, line bytes)
+
+    def stream(self, state: Optional[str] = None, season: Optional[str] = None,
+               soil_type: Optional[str] = None, chunk_lines: int = 500) -> Iterator[bytes]:
+        """Matching lines, joined into chunks of up to chunk_lines."""
+        chunk = []
+        for cell_state, cell_soil, cell_season, line in self.cells:
+            if (state is None or cell_state == state) and (season is None or cell_season == season) \
+                    and (soil_type is None or cell_soil == soil_type):
+                chunk.append(line)
+                if len(chunk) >= chunk_lines:
+                    yield b"".join(chunk)
+                    chunk = []
+        if chunk:
+            yield b"".join(chunk)
+
+    def __len__(self):
+        return len(self.cells)
+
+
+def state_profiles(states: Sequence[str], profiles: Optional[dict]) -> np.ndarray:
+    """(n_states, len(PROFILE_FIELDS)); states missing from the survey use the national profile."""
+    profiles = profiles or {}
+    national = profiles.get("national") or DEFAULT_PROFILE
+    by_state = profiles.get("states") or {}
+    return np.array([[float((by_state.get(s) or national)[f]) for f in PROFILE_FIELDS] for s in states])
+
+
+def season_temperatures(weather_table, states: Sequence[str]) -> np.ndarray:
+    """(n_states, n_seasons) mean of the monthly average temperatures over each season's months."""
+    temps = np.full((len(states), len(SEASON_MONTHS)), np.nan)
+    for i, state in enumerate(states):
+        code = weather_table.codes.get(state)
+        if code is None:
+            continue   # row() would hand back another state's weather
+        for j, months in enumerate(SEASON_MONTHS.values()):
+            values = weather_table.values[code, np.asarray(months) - 1, 0]
+            values = values[~np.isnan(values)]
+            if len(values):
+                temps[i, j] = float(np.mean(values, dtype=np.float64))
+    # States (or seasons) without weather data take the national mean for the season
+    known = ~np.isnan(temps)
+    fill = np.array([col[ok].mean() if ok.any() else DEFAULT_TEMPERATURE for col, ok in zip(temps.T, known.T)])
+    return np.where(known, temps, fill)
+
+
+def build_atlas(engine, matrix: np.ndarray, crop_names: Sequence[str], state_codes: Dict[str, int],
+                soil_codes: Dict[str, int], profiles: Optional[dict], weather_table, pool: int,
+                top_k: int) -> Atlas:
+    """Score every state × soil × season cell with one predict_proba call."""
+    states, soils, seasons = list(state_codes), list(soil_codes), list(SEASON_MONTHS)
+    nutrients = state_profiles(states, profiles)
+    temps = season_temperatures(weather_table, states)
+
+    # Cells in state → soil → season order
+    si, oi, zi = (a.ravel() for a in np.meshgrid(np.arange(len(states)), np.arange(len(soils)),
+                                                 np.arange(len(seasons)), indexing="ij"))
+    soil_enc = np.array([soil_codes[s] for s in soils], dtype=np.intp)
+    state_enc = np.array([state_codes[s] for s in states], dtype=np.intp)
+    # Same column order as main._crop_features: N, P, K, temperature, pH, moisture, state, soil, compat
+    features = np.column_stack([nutrients[si, :3], temps[si, zi], nutrients[si, 3:],
+                                state_enc[si], soil_enc[oi], np.full(len(si), 0.75)])
+    with metrics.stage("atlas_predict_proba"):
+        proba = np.asarray(engine.predict_proba(features))
+    with metrics.stage("atlas_rerank"):
+        top_idx, top_boosted, top_compat = soil_compat.rerank(proba, matrix, soil_enc[oi], pool, top_k)
+
+    cells = []
+    for row, (s, o, z) in enumerate(zip(si, oi, zi)):
+        record = {
+            "state": states[s],
+            "soilType": soils[o],
+            "season": seasons[z],
+            "inputs": {**dict(zip(PROFILE_FIELDS, nutrients[s].tolist())),
+                       "temperature": round(float(temps[s, z]), 1)},
+            "recommendations": [
+                {"crop": crop_names[i], "confidence": min(round(float(b) * 100, 1), 99.0),
+                 "soilCompatibility": soil_compat.match_label(float(c)), "soilScore": round(float(c) * 100)}
+                for i, b, c in zip(top_idx[row], top_boosted[row], top_compat[row])
+            ],
+        }
+        cells.append((states[s], soils[o], seasons[z], (json.dumps(record) + "\n").encode()))
+    return Atlas(datetime.datetime.now(), cells)
@@ -0,0 +1,119 @@
+"""
+In-process micro-batcher for the crop recommender.
+Concurrent single-row requests that arrive within a short window are stacked
+into one feature matrix and scored with a single predict_proba call; results
+are fanned back out to the waiting requests. A request that finds nothing
+queued and no batch in flight is scored at once, so the window only costs
+latency when there is something to coalesce with.
+"""
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, List
+
+# Upper bounds of the histogram buckets (last bucket is open-ended)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+WAIT_MS_BUCKETS = (0.5, 1, 2, 5, 10, 25, 50, 100)
+
+
+class MicroBatcher:
+    """Coalesce submit() calls for up to `window_ms` or `max_rows`, whichever comes first.
+
+    Uncontended calls (empty queue, no batch in flight) flush immediately.
+    """
+
+    def __init__(self, score_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+                 window_ms: float = 2.0, max_rows: int = 64):
+        self.score_batch = score_batch
+        self.window = window_ms / 1000.0
+        self.max_rows = max_rows
+        self._queue: list = []   # (item, future, enqueued_at)
+        self._timer = None
+        self._tasks: set = set()   # running _run() tasks; the loop only holds weak references
+        self._batch_sizes = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self._wait_ms = [0] * (len(WAIT_MS_BUCKETS) + 1)
+        self._wait_sum_ms = 0.0
+        self._wait_max_ms = 0.0
+        self._rows = 0
+        self._batches = 0
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((item, future, time.perf_counter()))
+        if len(self._queue) >= self.max_rows or (len(self._queue) == 1 and not self._tasks):
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._queue = self._queue, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def close(self):
+        """Cancel the pending flush, queued rows and in-flight batches (server shutdown)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._queue = self._queue, []
+        for _, future, _ in batch:
+            future.cancel()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, batch):
+        now = time.perf_counter()
+        self._record(batch, now)
+        try:
+            results = await self.score_batch([item for item, _, _ in batch])
+        except asyncio.CancelledError:
+            for _, future, _ in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _record(self, batch, now: float):
+        self._batches += 1
+        self._rows += len(batch)
+        self._batch_sizes[bisect_left(BATCH_SIZE_BUCKETS, len(batch))] += 1
+        for _, _, enqueued_at in batch:
+            wait_ms = (now - enqueued_at) * 1000.0
+            self._wait_ms[bisect_left(WAIT_MS_BUCKETS, wait_ms)] += 1
+            self._wait_sum_ms += wait_ms
+            self._wait_max_ms = max(self._wait_max_ms, wait_ms)
+
+    def stats(self) -> dict:
+        def histogram(bounds, counts):
+            labels = [f"<={b}" for b in bounds] + [f">{bounds[-1]}"]
+            return dict(zip(labels, counts))
+
+        return {
+            "windowMs": self.window * 1000.0,
+            "maxRows": self.max_rows,
+            "batches": self._batches,
+            "rows": self._rows,
+            "meanBatchSize": round(self._rows / self._batches, 2) if self._batches else 0.0,
+            "batchSizeHistogram": histogram(BATCH_SIZE_BUCKETS, self._batch_sizes),
+            "queueWaitMs": {
+                "mean": round(self._wait_sum_ms / self._rows, 3) if self._rows else 0.0,
+                "max": round(self._wait_max_ms, 3),
+                "histogram": histogram(WAIT_MS_BUCKETS, self._wait_ms),
+            },
+            "queued": len(self._queue),
+        }
@@ -0,0 +1,401 @@
+"""
+Latency / throughput benchmarks for the Crop Advisor ML API.
+
+  python benchmark.py load     drive the API with a realistic request mix
+                               (in-process ASGI, a local uvicorn, or --url)
+  python benchmark.py stages   per-stage timings of the crop pipeline
+                               (validation, encoding, inference, re-ranking, serialization)
+  python benchmark.py startup  model load time and peak RSS (fresh interpreter per run)
+  python benchmark.py train    wall time of each train_models.py stage + bundle export
+
+Every command writes its results as JSON (--out). With --baseline the results
+are compared against an earlier run: a latency metric (*_ms) more than
+--threshold slower, a memory metric (*_rss_mb) that much larger, or a
+throughput metric (*_rps) that much lower, is a regression and the command
+exits with status 1.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BACKEND_DIR, "..")
+SOIL_TYPES_JSON = os.path.join(BACKEND_DIR, "models", "saved", "soil_types.json")
+DEFAULT_MIX = "recommend=0.6,market=0.25,weather=0.15"
+
+
+def percentiles(samples_ms) -> dict:
+    a = np.asarray(samples_ms, dtype=float)
+    if not len(a):
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(a, [50, 95, 99])
+    return {"count": int(len(a)), "mean_ms": round(float(a.mean()), 3), "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3), "max_ms": round(float(a.max()), 3)}
+
+
+# ─── Request mix ────────────────────────────────────────────
+class RequestMix:
+    """Requests drawn from crops_india_master.csv (crop/state agronomy ranges) and soil_types.json."""
+
+    def __init__(self, weights: dict, seed: int = 0):
+        self.rng = random.Random(seed)
+        with open(os.path.join(DATA_DIR, "crops_india_master.csv"), newline="") as f:
+            self.crop_rows = list(csv.DictReader(f))
+        self.crops = sorted({r["crop_name"] for r in self.crop_rows})
+        self.states = sorted({r["state"] for r in self.crop_rows})
+        self.soils = self._soil_types()
+        self.kinds = list(weights)
+        self.weights = [weights[k] for k in self.kinds]
+
+    @staticmethod
+    def _soil_types() -> list:
+        if os.path.exists(SOIL_TYPES_JSON):
+            with open(SOIL_TYPES_JSON) as f:
+                return json.load(f)["soil_types"]
+        from soil_compat import ALL_SOIL_TYPES
+        return ALL_SOIL_TYPES
+
+    def recommend_body(self) -> dict:
+        r = self.rng.choice(self.crop_rows)
+        u = self.rng.uniform
+        return {
+            "N": round(float(r["ideal_n"]) * u(0.7, 1.3), 1),
+            "P": round(float(r["ideal_p"]) * u(0.7, 1.3), 1),
+            "K": round(float(r["ideal_k"]) * u(0.7, 1.3), 1),
+            "temperature": round(u(float(r["temp_min_c"]), float(r["temp_max_c"])), 1),
+            "pH": round(u(float(r["ph_min"]), float(r["ph_max"])), 2),
+            "moisture": round(u(float(r["soil_moisture_min"]), float(r["soil_moisture_max"])), 1),
+            "state": r["state"],
+            "soil_type": self.rng.choice(self.soils),
+        }
+
+    def next(self) -> tuple:
+        """(kind, path, json body)"""
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == "recommend":
+            return kind, "/api/recommend-crops", self.recommend_body()
+        if kind == "market":
+            return kind, "/api/market-prices", {"crop_name": self.rng.choice(self.crops),
+                                                "state": self.rng.choice(self.states)}
+        if kind == "weather":
+            return kind, "/api/weather-analysis", {"state": self.rng.choice(self.states),
+                                                   "month": self.rng.randint(1, 12)}
+        if kind == "batch":
+            return kind, "/api/recommend-crops/batch", {"items": [self.recommend_body() for _ in range(32)]}
+        raise ValueError(f"Unknown request kind: {kind}")
+
+
+def parse_mix(spec: str) -> dict:
+    weights = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+# ─── Load test ──────────────────────────────────────────────
+async def _drive(client, mix: RequestMix, total: int, concurrency: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        _, path, body = mix.next()
+        await client.post(path, json=body)
+
+    plan = [mix.next() for _ in range(total)]
+    latencies = {kind: [] for kind in mix.kinds}
+    statuses: dict = {}
+    cursor = iter(plan)
+
+    async def worker():
+        for kind, path, body in cursor:
+            start = time.perf_counter()
+            response = await client.post(path, json=body)
+            latencies[kind].append((time.perf_counter() - start) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    all_ms = [ms for samples in latencies.values() for ms in samples]
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1),
+        "latency": percentiles(all_ms),
+        "endpoints": {kind: percentiles(samples) for kind, samples in latencies.items() if samples},
+        "status_codes": {str(k): v for k, v in sorted(statuses.items())},
+    }
+
+
+async def _load_asgi(args, mix: RequestMix) -> dict:
+    import httpx
+    import main
+    await main.load_models()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            return await _drive(client, mix, args.requests, args.concurrency, args.warmup)
+    finally:
+        await main.stop_executor()
+
+
+async def _load_http(args, mix: RequestMix, url: str) -> dict:
+    import httpx
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+        return await _drive(client, mix, args.requests, args.concurrency, args.warmup)
+
+
+def _start_uvicorn(port: int, workers: int, env: dict) -> subprocess.Popen:
+    import httpx
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {proc.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/health", timeout=1).status_code == 200:
+                return proc
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("uvicorn did not become healthy within 60s")
+
+
+def cmd_load(args) -> dict:
+    if not args.cache:
+        # Measure the compute path, not the response cache
+        for name in ("SOIL_TYPES", "WEATHER", "MARKET", "RECOMMEND"):
+            os.environ[f"CACHE_TTL_{name}"] = "0"
+    mix = RequestMix(parse_mix(args.mix), seed=args.seed)
+    result = {"mode": "url" if args.url else args.mode, "mix": args.mix, "cache": args.cache}
+    if args.url:
+        result.update(asyncio.run(_load_http(args, mix, args.url)))
+    elif args.mode == "asgi":
+        result.update(asyncio.run(_load_asgi(args, mix)))
+    else:
+        proc = _start_uvicorn(args.port, args.workers, dict(os.environ))
+        try:
+            result.update(asyncio.run(_load_http(args, mix, f"http://127.0.0.1:{args.port}")))
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+    lat = result["latency"]
+    print(f"  {result['throughput_rps']} req/s  p50 {lat.get('p50_ms')} ms  "
+          f"p95 {lat.get('p95_ms')} ms  p99 {lat.get('p99_ms')} ms  status {result['status_codes']}")
+    return {"load": result}
+
+
+# ─── Crop pipeline stages ───────────────────────────────────
+def cmd_stages(args) -> dict:
+    import main
+    from cache import serialize
+    main._load_all_models()
+    m = main.models
+    if m is None:
+        raise SystemExit("Models not loaded. Run train_models.py first.")
+    mix = RequestMix({"recommend": 1.0}, seed=args.seed)
+    results = {}
+    for n in args.rows:
+        bodies = [mix.recommend_body() for _ in range(n)]
+        timings = {k: [] for k in ("validation", "encoding", "inference", "reranking", "formatting",
+                                   "serialization", "total")}
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            rows = [main.CropRecommendRequest.model_validate(b) for b in bodies]
+            t1 = time.perf_counter()
+            features, compat_cols = main._crop_features(m, rows)
+            t2 = time.perf_counter()
+            proba = m.crop_engine.predict_proba(features)
+            t3 = time.perf_counter()
+            ranked = main._rank_crops(m, proba, compat_cols)
+            t4 = time.perf_counter()
+            recs = main._format_ranked(m, *ranked)
+            t5 = time.perf_counter()
+            serialize({"results": recs})
+            t6 = time.perf_counter()
+            for key, (a, b) in zip(timings, [(t0, t1), (t1, t2), (t2, t3), (t3, t4), (t4, t5), (t5, t6), (t0, t6)]):
+                timings[key].append((b - a) * 1000)
+        results[f"rows_{n}"] = {stage: percentiles(ms) for stage, ms in timings.items()}
+        breakdown = "  ".join(f"{k} {results[f'rows_{n}'][k]['p50_ms']}" for k in timings)
+        print(f"  rows={n:<6} p50 ms: {breakdown}")
+    return {"stages": {"engine": m.inference_engine, "model_source": m.source, **results}}
+
+
+# ─── Model load ─────────────────────────────────────────────
+STARTUP_PROBE = (
+    "import json, resource, time; t = time.perf_counter(); import main; imported = time.perf_counter(); "
+    "main._load_all_models(); m = main.models; "
+    "print(json.dumps({'import_ms': (imported - t) * 1000, 'load_ms': m and m.load_ms, "
+    "'total_ms': (time.perf_counter() - t) * 1000, 'source': m and m.source, "
+    "'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))"
+)
+
+
+def cmd_startup(args) -> dict:
+    results = {}
+    for fmt in args.model_format:
+        env = dict(os.environ, MODEL_FORMAT=fmt)
+        runs = []
+        for _ in range(args.repeat):
+            out = subprocess.run([sys.executable, "-c", STARTUP_PROBE], cwd=BACKEND_DIR, env=env,
+                                 capture_output=True, text=True, check=True)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        results[fmt] = {
+            "source": runs[-1]["source"],
+            **{metric: percentiles([r[metric] for r in runs if r[metric] is not None])
+               for metric in ("import_ms", "load_ms", "total_ms")},
+            "peak_rss_mb": round(max(r["rss_mb"] for r in runs), 1),
+        }
+        print(f"  MODEL_FORMAT={fmt}: load p50 {results[fmt]['load_ms'].get('p50_ms')} ms, "
+              f"import+load p50 {results[fmt]['total_ms'].get('p50_ms')} ms, "
+              f"peak RSS {results[fmt]['peak_rss_mb']} MB")
+    return {"startup": results}
+
+
+# ─── Training stages ────────────────────────────────────────
+def cmd_train(args) -> dict:
+    import train_models
+    from bundle import export_bundle
+    params = train_models.stage_params(train_models.parse_args(["--samples-per-combo", str(args.samples_per_combo)]))
+    stages = args.stages or list(train_models.STAGES)
+    results = {}
+    with tempfile.TemporaryDirectory() as models_dir:
+        train_models.MODELS_DIR = models_dir   # keep the real models/saved untouched
+        for name in stages:
+            runs = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                train_models.STAGES[name]["fn"](params[name])
+                runs.append((time.perf_counter() - start) * 1000)
+            results[name] = percentiles(runs)
+        if set(train_models.STAGES) <= set(stages):
+            runs = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                export_bundle(models_dir, version="benchmark")
+                runs.append((time.perf_counter() - start) * 1000)
+            results["bundle"] = percentiles(runs)
+    for name, r in results.items():
+        print(f"  {name}: p50 {r['p50_ms']} ms")
+    return {"train": results}
+
+
+# ─── Baseline comparison ────────────────────────────────────
+def flatten(d: dict, prefix: str = "") -> dict:
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}.{k}" if prefix else str(k)
+        if isinstance(v, dict):
+            out.update(flatten(v, key))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = v
+    return out
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Metrics that regressed by more than threshold (fraction) against the baseline."""
+    cur, base = flatten(current), flatten(baseline)
+    regressions = []
+    for key, old in base.items():
+        new = cur.get(key)
+        if new is None or old <= 0:
+            continue
+        # Tail latencies, means and memory; counts and max_ms are too noisy to gate on
+        if key.endswith(("p50_ms", "p95_ms", "p99_ms", "mean_ms", "_rss_mb")) and new > old * (1 + threshold):
+            regressions.append({"metric": key, "baseline": old, "current": new, "change": round(new / old - 1, 3)})
+        elif key.endswith("_rps") and new < old * (1 - threshold):
+            regressions.append({"metric": key, "baseline": old, "current": new, "change": round(new / old - 1, 3)})
+    return regressions
+
+
+# ─── CLI ────────────────────────────────────────────────────
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Crop Advisor API benchmarks")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--out", default="benchmark_results.json", help="where to write the JSON results")
+    common.add_argument("--baseline", help="earlier results JSON to compare against")
+    common.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed regression as a fraction (default: 0.2 = 20%%)")
+    common.add_argument("--seed", type=int, default=0, help="request-mix random seed")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    load = sub.add_parser("load", parents=[common], help="load test the API")
+    load.add_argument("--mode", choices=("asgi", "uvicorn"), default="asgi")
+    load.add_argument("--url", help="benchmark an already running server instead")
+    load.add_argument("--requests", type=int, default=2000)
+    load.add_argument("--concurrency", type=int, default=16)
+    load.add_argument("--warmup", type=int, default=50)
+    load.add_argument("--mix", default=DEFAULT_MIX,
+                      help=f"request kinds and weights: recommend, market, weather, batch (default: {DEFAULT_MIX})")
+    load.add_argument("--cache", action="store_true", help="keep the response cache enabled")
+    load.add_argument("--port", type=int, default=8765)
+    load.add_argument("--workers", type=int, default=1, help="uvicorn workers (--mode uvicorn)")
+
+    stages = sub.add_parser("stages", parents=[common], help="crop pipeline stage breakdown")
+    stages.add_argument("--rows", type=lambda s: [int(x) for x in s.split(",")], default=[1, 64, 1024],
+                        help="batch sizes (default: 1,64,1024)")
+    stages.add_argument("--repeat", type=int, default=200)
+
+    startup = sub.add_parser("startup", parents=[common], help="model load time")
+    startup.add_argument("--model-format", type=lambda s: s.split(","), default=["auto"],
+                         help="MODEL_FORMAT values to compare, e.g. bundle,pickle")
+    startup.add_argument("--repeat", type=int, default=5)
+
+    train = sub.add_parser("train", parents=[common], help="train_models.py stage timings")
+    train.add_argument("--stages", type=lambda s: s.split(","), default=None,
+                       help="comma-separated stages (default: every train_models.STAGES entry, plus the bundle)")
+    train.add_argument("--samples-per-combo", type=int, default=15)
+    train.add_argument("--repeat", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+COMMANDS = {"load": cmd_load, "stages": cmd_stages, "startup": cmd_startup, "train": cmd_train}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sys.path.insert(0, BACKEND_DIR)
+    print(f"[benchmark] {args.command}")
+    results = {
+        "meta": {"command": args.command, "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        **COMMANDS[args.command](args),
+    }
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare({k: v for k, v in results.items() if k != "meta"},
+                              {k: v for k, v in baseline.items() if k != "meta"}, args.threshold)
+        results["regressions"] = regressions
+        for r in regressions:
+            print(f"  ✗ {r['metric']}: {r['baseline']} → {r['current']} ({r['change']:+.0%})")
+        if regressions:
+            status = 1
+        else:
+            print(f"  ✓ no regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"  results written to {args.out}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
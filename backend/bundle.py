@@ -0,0 +1,202 @@
+"""
+Fast-start model bundle.
+train_models.py exports every serving artifact into models/saved/bundle/:
+  bundle.json          format version, encoder vocabularies, scaler and booster constants,
+                       soil types and soil profiles
+  <forest>.<col>.npy   flattened tree-ensemble node arrays (loaded with mmap_mode="r");
+                       the crop forest is applied after the StandardScaler stored in bundle.json,
+                       the quantile forest concatenates the P10/P50/P90 price models
+  price_lag / weather  dense float32 lookup tables (tables.py), copied as trained
+  weather_history.*    state-partitioned monthly series (weather_history.py), copied as trained
+Loading needs only numpy + json, and the OS page cache shares the
+memory-mapped arrays between uvicorn workers on the same host. bundle.json
+also records the SHA-256 of crop_model.pkl, so the opt-in sklearn route for
+large client batches (CROP_SKLEARN_BATCH_ROWS) can load the matching pickle
+from models/saved.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from tables import LAG_FILES, WEATHER_FILES, LagTable, WeatherTable
+from tree_engine import (FlatBoostingRegressor, FlatForestClassifier, FlatQuantileRegressor,
+                         boosting_constants, forest_arrays, quantile_arrays)
+from weather_history import FILES as HISTORY_FILES, WeatherHistory
+
+BUNDLE_FORMAT = 6
+BUNDLE_DIRNAME = "bundle"
+FOREST_COLUMNS = ("feature", "threshold", "left", "right", "value", "roots")
+
+
+# ─── Serving-side stand-ins for the sklearn objects ────────
+class Vocabulary:
+    """LabelEncoder replacement: classes_ is the sorted vocabulary, code = position."""
+
+    def __init__(self, classes: List[str]):
+        self.classes_ = np.asarray(classes, dtype=object)
+
+
+class Standardizer:
+    """StandardScaler.transform with the fitted mean/scale."""
+
+    def __init__(self, mean, scale):
+        self.mean_ = np.asarray(mean, dtype=float)
+        self.scale_ = np.asarray(scale, dtype=float)
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=float) - self.mean_) / self.scale_
+
+
+# ─── Export (training side) ─────────────────────────────────
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _save_arrays(out_dir: str, prefix: str, arrays: dict):
+    for col, arr in arrays.items():
+        np.save(os.path.join(out_dir, f"{prefix}.{col}.npy"), np.ascontiguousarray(arr))
+
+
+def export_bundle(models_dir: str, version: str) -> str:
+    """Build models_dir/bundle from the pickles and lookup tables written by train_models.py."""
+    import joblib
+
+    out_dir = os.path.join(models_dir, BUNDLE_DIRNAME)
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    def load(name):
+        return joblib.load(os.path.join(models_dir, name))
+
+    crop_model, crop_scaler = load("crop_model.pkl"), load("crop_scaler.pkl")
+    price_model = load("price_model.pkl")
+    vocab = {
+        "state": [str(c) for c in load("state_encoder.pkl").classes_],
+        "soil": [str(c) for c in load("soil_encoder.pkl").classes_],
+        "crop": [str(c) for c in load("crop_encoder.pkl").classes_],
+        "price_crop": [str(c) for c in load("price_crop_encoder.pkl").classes_],
+        "price_state": [str(c) for c in load("price_state_encoder.pkl").classes_],
+    }
+
+    _save_arrays(tmp_dir, "crop_forest", forest_arrays(crop_model, classifier=True))
+    _save_arrays(tmp_dir, "price_forest", forest_arrays(price_model, classifier=False))
+
+    price_quantiles = None
+    if os.path.exists(os.path.join(models_dir, "price_quantile_models.pkl")):
+        saved = load("price_quantile_models.pkl")
+        arrays, constants = quantile_arrays(saved["models"])
+        _save_arrays(tmp_dir, "quantile_forest", arrays)
+        price_quantiles = {"quantiles": saved["quantiles"], "max_horizon": saved["max_horizon"],
+                           "starts": constants["starts"].tolist(), "init": constants["init"],
+                           "learning_rate": constants["learning_rate"]}
+
+    for name in LAG_FILES + WEATHER_FILES + HISTORY_FILES:
+        shutil.copyfile(os.path.join(models_dir, name), os.path.join(tmp_dir, name))
+
+    soil_types = None
+    soil_json = os.path.join(models_dir, "soil_types.json")
+    if os.path.exists(soil_json):
+        with open(soil_json) as f:
+            soil_types = json.load(f)
+    soil_profiles = None
+    profiles_json = os.path.join(models_dir, "soil_profiles.json")
+    if os.path.exists(profiles_json):
+        with open(profiles_json) as f:
+            soil_profiles = json.load(f)
+
+    meta = {
+        "format": BUNDLE_FORMAT,
+        "version": version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "vocab": vocab,
+        "crop_scaler": {"mean": crop_scaler.mean_.tolist(), "scale": crop_scaler.scale_.tolist()},
+        "crop_model_sha256": file_sha256(os.path.join(models_dir, "crop_model.pkl")),
+        "price_model": boosting_constants(price_model),
+        "price_quantiles": price_quantiles,
+        "soil_types": soil_types,
+        "soil_profiles": soil_profiles,
+    }
+    with open(os.path.join(tmp_dir, "bundle.json"), "w") as f:
+        json.dump(meta, f)
+
+    # Swap the finished bundle into place
+    old_dir = out_dir + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return out_dir
+
+
+# ─── Load (serving side) ────────────────────────────────────
+class ModelBundle:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "bundle.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"Unsupported bundle format {self.meta.get('format')} (expected {BUNDLE_FORMAT})")
+        self.version = self.meta["version"]
+        self.vocab = self.meta["vocab"]
+
+    def _arrays(self, prefix: str, columns) -> list:
+        return [np.load(os.path.join(self.path, f"{prefix}.{c}.npy"), mmap_mode="r") for c in columns]
+
+    def encoder(self, name: str) -> Vocabulary:
+        return Vocabulary(self.vocab[name])
+
+    def crop_scaler(self) -> Standardizer:
+        return Standardizer(**self.meta["crop_scaler"])
+
+    def crop_model(self) -> FlatForestClassifier:
+        """Takes raw (unscaled) features: the stored scaler is applied before the trees."""
+        return FlatForestClassifier(*self._arrays("crop_forest", FOREST_COLUMNS), **self.meta["crop_scaler"])
+
+    def sklearn_crop_model(self, models_dir: str):
+        """The fitted RandomForestClassifier this bundle was exported from (needs scikit-learn + joblib)."""
+        import joblib
+        path = os.path.join(models_dir, "crop_model.pkl")
+        if file_sha256(path) != self.meta["crop_model_sha256"]:
+            raise ValueError("crop_model.pkl does not match the bundle; re-run train_models.py")
+        return joblib.load(path)
+
+    def price_model(self) -> FlatBoostingRegressor:
+        return FlatBoostingRegressor(*self._arrays("price_forest", FOREST_COLUMNS), **self.meta["price_model"])
+
+    def price_quantiles(self) -> Optional[FlatQuantileRegressor]:
+        """None for bundles exported before the quantile models were trained."""
+        constants = self.meta.get("price_quantiles")
+        if not constants:
+            return None
+        return FlatQuantileRegressor(*self._arrays("quantile_forest", FOREST_COLUMNS), **constants)
+
+    def soil_types(self) -> Optional[dict]:
+        return self.meta.get("soil_types")
+
+    def soil_profiles(self) -> Optional[dict]:
+        return self.meta.get("soil_profiles")
+
+    def lag_table(self) -> LagTable:
+        return LagTable.load(self.path)
+
+    def weather_table(self) -> WeatherTable:
+        return WeatherTable.load(self.path)
+
+    def weather_history(self) -> Optional[WeatherHistory]:
+        return WeatherHistory.load(self.path) if WeatherHistory.available(self.path) else None
+
+
+def find_bundle(models_dir: str) -> Optional[str]:
+    path = os.path.join(models_dir, BUNDLE_DIRNAME)
+    return path if os.path.exists(os.path.join(path, "bundle.json")) else None
@@ -0,0 +1,107 @@
+"""
+Response cache for the deterministic endpoints.
+Serialized JSON bodies are kept in an LRU bounded by entry count and total
+bytes, each with a per-endpoint TTL. Every entry carries an ETag so clients
+and CDNs can revalidate with If-None-Match and get a 304 instead of a body.
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from fastapi import Request, Response
+
+
+def serialize(payload) -> bytes:
+    """Same encoding as FastAPI's JSONResponse."""
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "expires_at", "max_age")
+
+    def __init__(self, body: bytes, ttl: float):
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.max_age = int(ttl)
+        self.expires_at = time.monotonic() + ttl
+
+    def to_response(self, request: Optional[Request] = None) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": f"public, max-age={self.max_age}"}
+        if request is not None and self.etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+
+class ResponseCache:
+    """LRU of CachedResponse keyed by (endpoint, normalized request key)."""
+
+    def __init__(self, max_entries: int = 4096, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, CachedResponse]" = OrderedDict()
+        self._bytes = 0
+        self._hits: dict = {}
+        self._misses: dict = {}
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, endpoint: str, key: Hashable) -> Optional[CachedResponse]:
+        full_key = (endpoint, key)
+        entry = self._entries.get(full_key)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            self._remove(full_key)
+            entry = None
+        if entry is None:
+            self._misses[endpoint] = self._misses.get(endpoint, 0) + 1
+            return None
+        self._entries.move_to_end(full_key)
+        self._hits[endpoint] = self._hits.get(endpoint, 0) + 1
+        return entry
+
+    def put(self, endpoint: str, key: Hashable, payload, ttl: float) -> CachedResponse:
+        entry = CachedResponse(serialize(payload), ttl)
+        if ttl <= 0 or len(entry.body) > self.max_bytes:
+            return entry
+        full_key = (endpoint, key)
+        if full_key in self._entries:
+            self._remove(full_key)
+        self._entries[full_key] = entry
+        self._bytes += len(entry.body)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+        return entry
+
+    def invalidate(self, endpoint: Optional[str] = None):
+        """Drop every entry (e.g. after a model reload), or only one endpoint's."""
+        self._invalidations += 1
+        if endpoint is None:
+            self._entries.clear()
+            self._bytes = 0
+            return
+        for full_key in [k for k in self._entries if k[0] == endpoint]:
+            self._remove(full_key)
+
+    def _remove(self, full_key: tuple):
+        entry = self._entries.pop(full_key)
+        self._bytes -= len(entry.body)
+
+    def stats(self) -> dict:
+        endpoints = sorted(set(self._hits) | set(self._misses))
+        per_endpoint = {}
+        for ep in endpoints:
+            hits, misses = self._hits.get(ep, 0), self._misses.get(ep, 0)
+            per_endpoint[ep] = {"hits": hits, "misses": misses,
+                                "hitRatio": round(hits / (hits + misses), 4) if hits + misses else 0.0}
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "maxEntries": self.max_entries,
+            "maxBytes": self.max_bytes,
+            "evictions": self._evictions,
+            "invalidations": self._invalidations,
+            "endpoints": per_endpoint,
+        }
@@ -0,0 +1,210 @@
+"""
+Vectorized price forecasting over every crop × state pair.
+The 4-phase autoregressive rollout runs as one matrix predict per phase for
+all pairs at once; the result is kept as an in-memory table that
+/api/market-prices reads from. When the quantile price models are trained,
+every horizon (1-12 months) × quantile for every pair also comes out of a
+single predict call: the models are direct multi-horizon (horizon is a
+feature) and predict the price ratio to the latest observed price.
+"""
+import datetime
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+import metrics
+
+PHASES = 4         # 4 × 15-day phases
+NOISE = 0.02       # ±2% realistic noise, seeded per (crop, state, month)
+PRICE_FLOOR = 500
+MAX_HORIZON = 12   # months
+
+
+def phase_noise(seed: int, crop_codes, state_codes, now: datetime.datetime) -> np.ndarray:
+    """Deterministic ±NOISE factors, one row per pair, so cached and live answers agree."""
+    return np.array([
+        np.random.default_rng([seed, int(c), int(s), now.year, now.month]).uniform(-NOISE, NOISE, PHASES)
+        for c, s in zip(crop_codes, state_codes)
+    ]).reshape(len(crop_codes), PHASES)
+
+
+def rollout(model, crop_codes, state_codes, lags: np.ndarray,
+            now: datetime.datetime, seed: int = 0) -> np.ndarray:
+    """Forecast PHASES steps for n pairs. lags is (n, 5): base, lag1, lag3, lag6, lag12."""
+    n = len(crop_codes)
+    with metrics.stage("price_noise"):
+        noise = phase_noise(seed, crop_codes, state_codes, now)
+    prices = np.empty((n, PHASES))
+    prev_price = lags[:, 1].astype(float)
+    for phase in range(PHASES):
+        future_month = (now.month + phase) % 12 + 1
+        future_year = now.year + ((now.month + phase) // 12)
+        X_pred = np.column_stack([
+            crop_codes, state_codes,
+            np.full(n, future_year), np.full(n, future_month),
+            prev_price, lags[:, 2], lags[:, 3], lags[:, 4],
+        ])
+        with metrics.stage(f"price_predict_phase{phase + 1}"):
+            predicted = model.predict(X_pred)
+        predicted = np.maximum(PRICE_FLOOR, predicted + predicted * noise[:, phase])
+        prices[:, phase] = predicted
+        prev_price = predicted
+    return prices
+
+
+def horizon_features(crop_codes, state_codes, target_month, horizon, lags) -> np.ndarray:
+    """Quantile-model features; lags is (n, 5): latest price, lag1, lag3, lag6, lag12. Shared with training."""
+    lags = np.asarray(lags, dtype=float)
+    return np.column_stack([crop_codes, state_codes, target_month, horizon, lags])
+
+
+def quantile_grid(model, crop_codes, state_codes, lags: np.ndarray, now: datetime.datetime,
+                  horizons: Optional[int] = None) -> np.ndarray:
+    """(n_pairs, horizons, n_quantiles) price forecasts from one batched predict."""
+    horizons = horizons or model.max_horizon
+    n = len(crop_codes)
+    lags = np.asarray(lags, dtype=float).reshape(n, 5)
+    h = np.tile(np.arange(1, horizons + 1), n)
+    rows = np.repeat(np.arange(n), horizons)
+    X = horizon_features(np.asarray(crop_codes)[rows], np.asarray(state_codes)[rows],
+                         (now.month - 1 + h) % 12 + 1, h, lags[rows])
+    with metrics.stage("price_predict_quantiles"):
+        ratios = model.predict(X)
+    prices = np.maximum(PRICE_FLOOR, ratios * lags[rows, :1])
+    return prices.reshape(n, horizons, -1)
+
+
+def interpolate_quantiles(grid: np.ndarray, trained, requested) -> np.ndarray:
+    """Linear interpolation along the last axis from trained to requested quantile levels."""
+    trained = np.asarray(trained, dtype=float)
+    requested = np.asarray(requested, dtype=float)
+    if len(trained) == 1:
+        return grid[..., np.zeros(len(requested), dtype=np.intp)]
+    hi = np.clip(np.searchsorted(trained, requested), 1, len(trained) - 1)
+    lo = hi - 1
+    w = np.clip((requested - trained[lo]) / (trained[hi] - trained[lo]), 0.0, 1.0)
+    return grid[..., lo] * (1 - w) + grid[..., hi] * w
+
+
+def quantile_label(q: float) -> str:
+    """Response key for a quantile level: 0.1 -> "p10", 0.05 -> "p05", 0.125 -> "p12.5"."""
+    return f"p{round(q * 100, 6):02g}"
+
+
+def format_horizons(base_price: float, grid: np.ndarray, quantiles, now: datetime.datetime) -> list:
+    """One entry per month ahead; grid is (horizons, len(quantiles)) for one pair."""
+    out = []
+    median_col = int(np.argmin(np.abs(np.asarray(quantiles) - 0.5)))
+    previous = base_price
+    for h, row in enumerate(grid, start=1):
+        month = (now.month - 1 + h) % 12 + 1
+        year = now.year + (now.month - 1 + h) // 12
+        median = float(row[median_col])
+        trend = "up" if median > previous else ("down" if median < previous * 0.99 else "stable")
+        out.append({
+            "horizon": h,
+            "label": datetime.date(year, month, 1).strftime("%b %Y"),
+            "price": round(median),
+            "trend": trend,
+            "quantiles": {quantile_label(q): round(float(v)) for q, v in zip(quantiles, row)},
+        })
+        previous = median
+    return out
+
+
+def format_phases(base_price: float, prices) -> list:
+    phases = []
+    current_price = base_price
+    for phase, predicted in enumerate(prices):
+        predicted = float(predicted)
+        trend = "up" if predicted > current_price else ("down" if predicted < current_price * 0.99 else "stable")
+        phases.append({
+            "phase": phase + 1,
+            "label": f"Days {phase*15+1}–{phase*15+15}",
+            "price": round(predicted),
+            "trend": trend,
+            "confidence": round(90 - phase * 5),  # Decreasing confidence over time
+        })
+        current_price = predicted
+    return phases
+
+
+class ForecastTable:
+    """(crop, state) -> (base_price, phases) for one forecast date."""
+
+    def __init__(self, built_at: datetime.datetime, entries: Dict[Tuple[str, str], tuple],
+                 grid: Optional[np.ndarray] = None, grid_rows: Optional[Dict[Tuple[str, str], int]] = None):
+        self.built_at = built_at
+        self.entries = entries
+        self.grid = grid              # (n_pairs, MAX_HORIZON, n_quantiles) or None
+        self.grid_rows = grid_rows or {}
+
+    def is_current(self, now: datetime.datetime) -> bool:
+        return self.built_at.date() == now.date()
+
+    def get(self, crop: str, state: str) -> Optional[tuple]:
+        return self.entries.get((crop, state))
+
+    def get_grid(self, crop: str, state: str) -> Optional[np.ndarray]:
+        row = self.grid_rows.get((crop, state))
+        return None if row is None or self.grid is None else self.grid[row]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def build_table(model, crop_codes: dict, state_codes: dict, lag_table, now: datetime.datetime,
+                seed: int = 0, quantile_model=None) -> ForecastTable:
+    """Run the rollout (and the quantile grid, if trained) for every known crop × state pair in one batched pass.
+
+    Pairs without their own lag row use the crop's first cached row, matching
+    the per-request fallback.
+    """
+    all_keys = [(crop, state) for crop in crop_codes for state in state_codes]
+    crops = np.repeat(np.fromiter(crop_codes.values(), dtype=np.intp, count=len(crop_codes)), len(state_codes))
+    states = np.tile(np.fromiter(state_codes.values(), dtype=np.intp, count=len(state_codes)), len(crop_codes))
+    lags, found = lag_table.gather(crops, states)
+    if not found.any():
+        return ForecastTable(now, {})
+
+    keys = [key for key, ok in zip(all_keys, found) if ok]
+    crops, states = crops[found], states[found]
+    prices = rollout(model, crops, states, lags, now, seed)
+    entries = {
+        key: (float(row[0]), format_phases(float(row[0]), forecast))
+        for key, row, forecast in zip(keys, lags, prices)
+    }
+    grid = None
+    if quantile_model is not None:
+        grid = quantile_grid(quantile_model, crops, states, lags, now)
+    return ForecastTable(now, entries, grid, {key: i for i, key in enumerate(keys)})
+
+
+def persist_table(table: ForecastTable, database_url: str):
+    """Upsert the table into market_predictions (database/schema.sql): one row per pair and day,
+    so a rerun on the same day overwrites that day's prices instead of duplicating them."""
+    from sqlalchemy import create_engine, text
+
+    rows = [
+        {
+            "crop_name": crop, "state": state, "base_price": base,
+            **{f"p{i + 1}": phases[i]["price"] for i in range(PHASES)},
+        }
+        for (crop, state), (base, phases) in table.entries.items()
+    ]
+    if not rows:
+        return
+    engine = create_engine(database_url)
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO market_predictions "
+                "(crop_name, state, base_price, phase1_price, phase2_price, phase3_price, phase4_price) "
+                "VALUES (:crop_name, :state, :base_price, :p1, :p2, :p3, :p4) "
+                "ON CONFLICT (crop_name, state, predicted_on) DO UPDATE SET "
+                "base_price = EXCLUDED.base_price, phase1_price = EXCLUDED.phase1_price, "
+                "phase2_price = EXCLUDED.phase2_price, phase3_price = EXCLUDED.phase3_price, "
+                "phase4_price = EXCLUDED.phase4_price, predicted_at = NOW()"
+            ), rows)
+    finally:
+        engine.dispose()
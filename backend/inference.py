@@ -0,0 +1,78 @@
+"""
+Bounded executor for CPU-bound model inference.
+Keeps RandomForest / GradientBoosting calls off the asyncio event loop so
+/api/health and lookup endpoints stay responsive while a prediction runs.
+"""
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+
+class ExecutorOverloaded(Exception):
+    """Raised when the inference queue is full; maps to HTTP 503 + Retry-After."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Inference queue is full, retry shortly.")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """Thread or process pool with a cap on queued + running jobs.
+
+    mode="thread"  — sklearn releases the GIL inside tree evaluation, so a
+                     thread pool scales across cores with shared models.
+    mode="process" — each worker loads the models once via `initializer`.
+    """
+
+    def __init__(self, mode: str = "thread", workers: Optional[int] = None,
+                 max_pending: int = 64, retry_after: int = 1,
+                 initializer: Optional[Callable[[], None]] = None):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown inference executor mode: {mode}")
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.initializer = initializer
+        self._pool: Optional[Executor] = None
+        self._pending = 0  # only touched from the event loop thread
+
+    def start(self):
+        if self._pool is not None:
+            return
+        if self.mode == "process":
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=self.initializer)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+
+    def restart(self):
+        """Replace the pool (e.g. after a model swap); jobs already running finish on the old one."""
+        old, self._pool = self._pool, None
+        self.start()
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def run(self, fn: Callable, *args):
+        """Run fn(*args) on the pool, or raise ExecutorOverloaded if the queue is full."""
+        if self._pending >= self.max_pending:
+            raise ExecutorOverloaded(self.retry_after)
+        self.start()
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            self._pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "pending": self._pending,
+            "maxPending": self.max_pending,
+        }
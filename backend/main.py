@@ -2,16 +2,34 @@
 FastAPI ML Backend for Crop Advisor System
 Run: uvicorn main:app --host 0.0.0.0 --port 8000 --reload
 """
+import asyncio
+import datetime
+import hmac
+import math
 import os
+import threading
 import traceback
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError, model_validator
+from typing import Dict, Optional, List
 import numpy as np
-import pandas as pd
-import joblib
 from dotenv import load_dotenv
+import atlas
+import forecast
+import metrics
+from batcher import MicroBatcher
+from cache import ResponseCache
+import soil_compat
+import sweep
+import weather_history
+from soil_compat import CROP_SOIL_TYPES
+from inference import ExecutorOverloaded, InferenceExecutor
+from registry import ModelRegistry, StaleModels, artifact_fingerprint, load_registry
+from sensors import (SensorReading, SensorReadingsBatch, SensorStore, column_chunks, latest_per_user,
+                     rows_to_columns, stamp_missing)
 
 load_dotenv()
 
@@ -26,70 +44,229 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ─── Metrics ────────────────────────────────────────────────
+# GET /api/metrics serves Prometheus text. PROFILE_SLOW_MS > 0 turns on the
+# sampling profiler: requests slower than that (or sent with X-Profile: 1 and
+# the ADMIN_TOKEN as X-Admin-Token) get a collapsed-stack profile written to PROFILE_DIR.
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+profiler = metrics.SamplingProfiler(
+    out_dir=os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles")),
+    slow_ms=PROFILE_SLOW_MS,
+    interval_ms=float(os.getenv("PROFILE_INTERVAL_MS", "5")),
+) if PROFILE_SLOW_MS > 0 else None
+app.add_middleware(metrics.MetricsMiddleware, profiler=profiler, profile_token=os.getenv("ADMIN_TOKEN"))
+
 # ─── Model paths ────────────────────────────────────────────
 MODELS_DIR = os.path.join(os.path.dirname(__file__), "models", "saved")
+# MODEL_FORMAT=auto uses models/saved/bundle when present, else the pickles + CSVs.
+MODEL_FORMAT = os.getenv("MODEL_FORMAT", "auto")  # auto | bundle | pickle
+COLD_START_BUDGET_MS = float(os.getenv("COLD_START_BUDGET_MS", "1500"))
+# INFERENCE_ENGINE=compiled evaluates the forests with tree_engine (pure NumPy);
+# sklearn keeps predict_proba / predict.
+# auto = compiled for the bundle (which only ships compiled trees), sklearn for pickles.
+INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "auto")  # auto | compiled | sklearn
+# CROP_SKLEARN_BATCH_ROWS > 0 sends client crop batches larger than this to
+# sklearn on the compiled engine (higher throughput, but every worker imports
+# sklearn and unpickles crop_model.pkl at load). Atlas and sweep stay compiled.
+CROP_SKLEARN_BATCH_ROWS = int(os.getenv("CROP_SKLEARN_BATCH_ROWS", "0"))
+
+# ─── Model registry ─────────────────────────────────────────
+# Every model, encoder and lookup index lives on one immutable ModelRegistry.
+# Handlers read `models` once and use that snapshot throughout; a reload builds
+# and smoke-tests a new registry in the background, then swaps this reference.
+models: Optional[ModelRegistry] = None
+previous_models: Optional[ModelRegistry] = None   # target of POST /api/admin/models/rollback
+last_reload: Optional[dict] = None
+# MODEL_WATCH_INTERVAL > 0 polls models/saved and hot-reloads retrained artifacts.
+# ADMIN_TOKEN enables the /api/admin/models endpoints (sent as X-Admin-Token).
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "0"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Forecast noise is seeded per (crop, state, month) so cached and live answers agree.
+# FORECAST_PERSIST=1 also writes each nightly table into market_predictions.
+FORECAST_SEED = int(os.getenv("FORECAST_SEED", "0"))
+FORECAST_PERSIST = os.getenv("FORECAST_PERSIST", "0") == "1"
 
-# ─── Load models on startup ─────────────────────────────────
-crop_model = None
-crop_scaler = None
-state_encoder = None
-soil_encoder = None
-crop_encoder = None
-price_model = None
-price_crop_enc = None
-price_state_enc = None
-lag_cache = None
-weather_lookup = None
-soil_types_data = None
-
-# Soil type compatibility (matches train_models.py)
-CROP_SOIL_TYPES = {
-    "Rice":       ["Clay", "Clay Loam", "Silty Clay", "Silty Loam"],
-    "Wheat":      ["Loamy", "Clay Loam", "Sandy Loam", "Black Cotton"],
-    "Maize":      ["Loamy", "Sandy Loam", "Sandy", "Clay Loam"],
-    "Cotton":     ["Black Cotton", "Clay Loam", "Sandy Clay", "Loamy"],
-    "Sugarcane":  ["Loamy", "Clay Loam", "Silty Loam", "Sandy Loam"],
-    "Soybean":    ["Loamy", "Sandy Loam", "Clay Loam", "Silty Loam"],
-    "Groundnut":  ["Sandy Loam", "Sandy", "Loamy", "Red Soil"],
-    "Pulses":     ["Sandy Loam", "Loamy", "Clay Loam", "Red Soil"],
-    "Millets":    ["Sandy", "Sandy Loam", "Loamy", "Red Soil"],
-    "Vegetables": ["Loamy", "Silty Loam", "Sandy Loam", "Clay Loam"],
+# ─── Response cache ─────────────────────────────────────────
+# Per-endpoint TTLs in seconds (0 disables caching for that endpoint).
+CACHE_TTLS = {
+    "soil-types":      float(os.getenv("CACHE_TTL_SOIL_TYPES", "86400")),
+    "weather-analysis": float(os.getenv("CACHE_TTL_WEATHER", "3600")),
+    "market-prices":   float(os.getenv("CACHE_TTL_MARKET", "900")),
+    "recommend-crops": float(os.getenv("CACHE_TTL_RECOMMEND", "300")),
 }
+# Crop recommendations are cached on inputs rounded to these steps (and scored on the rounded values).
+QUANTIZE_STEPS = {"N": 1.0, "P": 1.0, "K": 1.0, "temperature": 0.1, "pH": 0.01, "moisture": 0.1}
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "4096")),
+    max_bytes=int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+)
+
+# ─── Sensor ingestion ───────────────────────────────────────
+# Writes go through at most SENSOR_MAX_WRITERS pooled connections; further
+# concurrent bulk posts get 503 + Retry-After instead of queueing unboundedly.
+SENSOR_MAX_WRITERS = int(os.getenv("SENSOR_MAX_WRITERS", "4"))
+SENSOR_CHUNK_ROWS = int(os.getenv("SENSOR_CHUNK_ROWS", "5000"))
+SENSOR_MAX_ROWS = int(os.getenv("SENSOR_MAX_ROWS", "100000"))  # per columnar JSON body
+SENSOR_MAX_LINE_BYTES = int(os.getenv("SENSOR_MAX_LINE_BYTES", "65536"))  # per NDJSON line
+sensor_store = None
+_sensor_store_lock = threading.Lock()   # _get_sensor_store runs in worker threads
+_sensor_writers = asyncio.Semaphore(SENSOR_MAX_WRITERS)
+
+# Re-ranking: take the top CANDIDATE_POOL crops by model probability, boost by
+# soil compatibility and keep the best TOP_K.
+CANDIDATE_POOL = 6
+TOP_K = 4
+MAX_BATCH_ROWS = int(os.getenv("CROP_BATCH_MAX_ROWS", "5000"))
+MAX_SWEEP_POINTS = int(os.getenv("CROP_SWEEP_MAX_POINTS", "5000"))
+
+def _load_all_models():
+    """Initial load (startup, or a process-pool worker); failures leave `models` unset."""
+    global models
+    try:
+        models = load_registry(MODELS_DIR, MODEL_FORMAT, INFERENCE_ENGINE, CROP_SKLEARN_BATCH_ROWS)
+    except Exception as e:
+        print(f"⚠️  Model loading error (run train_models.py first): {e}")
+        return
+    response_cache.invalidate()
+    print(f"✓ Models loaded from {models.source} in {models.load_ms} ms")
+    if models.load_ms > COLD_START_BUDGET_MS:
+        print(f"⚠️  Cold start exceeded budget ({models.load_ms} ms > {COLD_START_BUDGET_MS:.0f} ms)")
 
-def get_soil_compat(crop: str, soil: str) -> float:
-    soils = CROP_SOIL_TYPES.get(crop, [])
-    if not soils or soil not in soils:
-        return 0.3
-    idx = soils.index(soil)
-    return [1.0, 0.9, 0.75, 0.75][min(idx, 3)]
+def _init_inference_worker():
+    """Process-pool initializer: load the models once per worker process."""
+    if models is None:
+        _load_all_models()
+
+def _job_models(ref) -> ModelRegistry:
+    """Registry for an executor job: the caller's snapshot (threads) or this worker's copy (processes)."""
+    if isinstance(ref, ModelRegistry):
+        return ref
+    if models is None or models.version != ref:
+        raise StaleModels("Models are being reloaded, retry shortly.")
+    return models
+
+# ─── Inference executor ─────────────────────────────────────
+# INFERENCE_EXECUTOR=thread|process, INFERENCE_WORKERS (default: CPU count),
+# INFERENCE_MAX_PENDING caps queued + running jobs before returning 503.
+executor = InferenceExecutor(
+    mode=os.getenv("INFERENCE_EXECUTOR", "thread"),
+    workers=int(os.getenv("INFERENCE_WORKERS", "0")) or None,
+    max_pending=int(os.getenv("INFERENCE_MAX_PENDING", "64")),
+    retry_after=int(os.getenv("INFERENCE_RETRY_AFTER", "1")),
+    initializer=_init_inference_worker,
+)
+
+async def _run_model_job(m: ModelRegistry, fn, *args):
+    """executor.run(fn, snapshot, *args); process workers get the version and check it instead."""
+    return await executor.run(fn, m if executor.mode == "thread" else m.version, *args)
+
+async def _score_on_executor(items):
+    """Score (snapshot, row) items, one model job per snapshot, so every request
+    is scored by the registry its cache key and ETag were taken from."""
+    groups: Dict[int, list] = {}
+    for i, (m, _) in enumerate(items):
+        groups.setdefault(id(m), []).append(i)
+    scored = await asyncio.gather(*(
+        _run_model_job(items[indexes[0]][0], _score_crop_rows, [items[i][1] for i in indexes])
+        for indexes in groups.values()))
+    results = [None] * len(items)
+    for indexes, recs in zip(groups.values(), scored):
+        for i, r in zip(indexes, recs):
+            results[i] = r
+    return results
+
+# Concurrent /api/recommend-crops calls within CROP_COALESCE_WINDOW_MS (or up to
+# CROP_COALESCE_MAX_ROWS rows) are scored together in one predict_proba call.
+crop_batcher = MicroBatcher(
+    _score_on_executor,
+    window_ms=float(os.getenv("CROP_COALESCE_WINDOW_MS", "2")),
+    max_rows=int(os.getenv("CROP_COALESCE_MAX_ROWS", "64")),
+)
+
+async def _refresh_forecasts():
+    global models
+    m = models
+    if m is None:
+        return
+    table = await _run_model_job(m, _build_forecast_table, datetime.datetime.now())
+    if models is not m:
+        return  # a reload swapped in newer models (with their own table) meanwhile
+    models = m.replace(forecast_table=table)
+    response_cache.invalidate("market-prices")
+    print(f"✓ Price forecasts precomputed for {len(table)} crop×state pairs")
+    database_url = os.getenv("DATABASE_URL")
+    if FORECAST_PERSIST and database_url:
+        try:
+            await asyncio.to_thread(forecast.persist_table, table, database_url)
+        except Exception as e:
+            print(f"⚠️  Could not persist price forecasts: {e}")
+
+async def _refresh_atlas():
+    global models
+    m = models
+    if m is None:
+        return
+    built = await _run_model_job(m, _build_atlas)
+    if models is not m:
+        return  # a reload swapped in newer models (with their own atlas) meanwhile
+    models = m.replace(atlas=built)
+    print(f"✓ Suitability atlas precomputed for {len(built)} state×soil×season cells")
+
+async def _forecast_refresher():
+    """Rebuild the forecast table shortly after every midnight."""
+    while True:
+        now = datetime.datetime.now()
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+        await asyncio.sleep((midnight - now).total_seconds() + 1)
+        try:
+            await _refresh_forecasts()
+        except Exception:
+            traceback.print_exc()
+
+_background_tasks = []
 
 @app.on_event("startup")
 async def load_models():
-    global crop_model, crop_scaler, state_encoder, soil_encoder, crop_encoder
-    global price_model, price_crop_enc, price_state_enc, lag_cache, weather_lookup, soil_types_data
-    import json
+    _load_all_models()
+    executor.start()
     try:
-        crop_model    = joblib.load(os.path.join(MODELS_DIR, "crop_model.pkl"))
-        crop_scaler   = joblib.load(os.path.join(MODELS_DIR, "crop_scaler.pkl"))
-        state_encoder = joblib.load(os.path.join(MODELS_DIR, "state_encoder.pkl"))
-        soil_encoder  = joblib.load(os.path.join(MODELS_DIR, "soil_encoder.pkl"))
-        crop_encoder  = joblib.load(os.path.join(MODELS_DIR, "crop_encoder.pkl"))
-        soil_json = os.path.join(MODELS_DIR, "soil_types.json")
-        if os.path.exists(soil_json):
-            with open(soil_json) as f:
-                soil_types_data = json.load(f)
-        print("✓ Crop recommendation model loaded (with soil_type)")
-
-        price_model     = joblib.load(os.path.join(MODELS_DIR, "price_model.pkl"))
-        price_crop_enc  = joblib.load(os.path.join(MODELS_DIR, "price_crop_encoder.pkl"))
-        price_state_enc = joblib.load(os.path.join(MODELS_DIR, "price_state_encoder.pkl"))
-        lag_cache       = pd.read_csv(os.path.join(MODELS_DIR, "price_lag_cache.csv"))
-        print("✓ Price prediction model loaded")
-
-        weather_lookup = pd.read_csv(os.path.join(MODELS_DIR, "weather_lookup.csv"))
-        print("✓ Weather lookup table loaded")
+        await _refresh_forecasts()
     except Exception as e:
-        print(f"⚠️  Model loading error (run train_models.py first): {e}")
+        print(f"⚠️  Price forecast precompute failed (serving live forecasts): {e}")
+    try:
+        await _refresh_atlas()
+    except Exception as e:
+        print(f"⚠️  Suitability atlas precompute failed: {e}")
+    _background_tasks.append(asyncio.create_task(_forecast_refresher()))
+    _background_tasks.append(asyncio.create_task(metrics.loop_lag_monitor()))
+    if MODEL_WATCH_INTERVAL > 0:
+        _background_tasks.append(asyncio.create_task(_watch_models()))
+    if profiler is not None:
+        profiler.start()
+
+@app.on_event("shutdown")
+async def stop_executor():
+    for task in _background_tasks:
+        task.cancel()
+    await crop_batcher.close()
+    executor.shutdown()
+    if profiler is not None:
+        profiler.stop()
+    if sensor_store is not None:
+        sensor_store.dispose()
+
+@app.exception_handler(StaleModels)
+async def stale_models(request: Request, exc: StaleModels):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(ExecutorOverloaded)
+async def executor_overloaded(request: Request, exc: ExecutorOverloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 # ─── Request / Response schemas ─────────────────────────────
 
@@ -104,9 +281,38 @@ class CropRecommendRequest(BaseModel):
     season: Optional[str] = "Kharif"
     soil_type: Optional[str] = "Loamy"
 
+class CropBatchRequest(BaseModel):
+    items: List[CropRecommendRequest]
+
+class SweepAxis(BaseModel):
+    """Explicit values, or `steps` evenly spaced values from start to stop."""
+    values: Optional[List[float]] = Field(None, max_length=1000)
+    start: Optional[float] = None
+    stop: Optional[float] = None
+    steps: int = Field(11, ge=2, le=1000)
+
+    @model_validator(mode="after")
+    def check_range(self):
+        if self.values is None and (self.start is None or self.stop is None):
+            raise ValueError("give either values or start and stop")
+        if self.values is not None and not self.values:
+            raise ValueError("values must not be empty")
+        return self
+
+    def grid(self) -> List[float]:
+        return self.values if self.values is not None else np.linspace(self.start, self.stop, self.steps).tolist()
+
+class CropSweepRequest(BaseModel):
+    base: CropRecommendRequest
+    vary: Dict[str, SweepAxis]           # keys: N, P, K, temperature, pH, moisture
+    target_crop: Optional[str] = None    # report the smallest input change that makes it the top pick
+    crops: Optional[List[str]] = None    # surfaces to return; default: every crop that tops some point
+
 class MarketPriceRequest(BaseModel):
     crop_name: str
     state: str
+    horizon: Optional[int] = Field(None, ge=1, le=forecast.MAX_HORIZON)  # months ahead; default: all trained
+    quantiles: Optional[List[float]] = None                              # e.g. [0.1, 0.5, 0.9]; default: trained
 
 class WeatherRequest(BaseModel):
     state: str
@@ -143,150 +349,358 @@ CROP_YIELDS = {
 
 @app.get("/api/health")
 async def health():
+    m = models
     return {
         "status": "ok",
-        "models_loaded": crop_model is not None,
+        "models_loaded": m is not None,
+        "model_version": m.version[:12] if m else None,
+        "model_source": m.source if m else None,
+        "model_load_ms": m.load_ms if m else None,
+        "inference_engine": m.inference_engine if m else None,
+        "inference": executor.stats(),
         "version": "1.0.0"
     }
 
 
+async def _cached_response(request: Request, endpoint: str, key, compute):
+    """Serve from the response cache, or await compute(snapshot) and cache its payload.
+
+    Keys include the model version, so entries never outlive a model swap.
+    """
+    m = models
+    key = (m.version if m else None, key)
+    entry = response_cache.get(endpoint, key)
+    if entry is None:
+        entry = response_cache.put(endpoint, key, await compute(m), CACHE_TTLS[endpoint])
+    return entry.to_response(request)
+
+
+metrics.registry.register(metrics.Gauge(
+    "crop_advisor_model_load_seconds", "Duration of the last model load.",
+    lambda: {(("source", models.source),): models.load_ms / 1000} if models else {}))
+metrics.registry.register(metrics.Gauge(
+    "crop_advisor_cache_hit_ratio", "Response cache hit ratio per endpoint.",
+    lambda: {(("endpoint", ep),): s["hitRatio"] for ep, s in response_cache.stats()["endpoints"].items()}))
+metrics.registry.register(metrics.Gauge(
+    "crop_advisor_cache_entries", "Entries in the response cache.",
+    lambda: {(): response_cache.stats()["entries"]}))
+metrics.registry.register(metrics.Gauge(
+    "crop_advisor_executor_pending", "Inference jobs queued or running on the executor.",
+    lambda: {(): executor.stats()["pending"]}))
+
+
+@app.get("/api/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition: request/stage latency histograms, in-flight, loop lag, caches."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/cache-stats")
+async def cache_stats():
+    """Response cache hit/miss counters per endpoint."""
+    return response_cache.stats()
+
+
 @app.get("/api/soil-types")
-async def get_soil_types():
+async def get_soil_types(request: Request):
     """Return all available soil types for the dropdown."""
-    if soil_types_data:
-        return soil_types_data
-    default_soils = ["Black Cotton", "Clay", "Clay Loam", "Loamy", "Red Soil",
-                     "Sandy", "Sandy Clay", "Sandy Loam", "Silty Clay", "Silty Loam"]
-    return {"soil_types": default_soils, "crop_soil_map": CROP_SOIL_TYPES}
+    async def compute(m):
+        if m is not None and m.soil_types_data:
+            return m.soil_types_data
+        default_soils = ["Black Cotton", "Clay", "Clay Loam", "Loamy", "Red Soil",
+                         "Sandy", "Sandy Clay", "Sandy Loam", "Silty Clay", "Silty Loam"]
+        return {"soil_types": default_soils, "crop_soil_map": CROP_SOIL_TYPES}
+    return await _cached_response(request, "soil-types", "all", compute)
+
+
+def _crop_features(m: ModelRegistry, rows: List[CropRecommendRequest]):
+    """(n, 9) model features plus each row's soil column in m.crop_soil_compat."""
+    # Build feature matrix: N, P, K, temperature, pH, moisture, state_enc, soil_type_enc, soil_compat
+    # soil_compat is applied per-crop in post-processing, use 0.75 as neutral for the prediction
+    features = np.array([[r.N, r.P, r.K, r.temperature, r.pH, r.moisture, 0.0, 0.0, 0.75]
+                         for r in rows], dtype=float)
+    features[:, 6] = [m.state_codes.get(r.state, 0) for r in rows]
+    features[:, 7] = [m.soil_codes.get(r.soil_type, 0) for r in rows]
+    # Compat column follows the raw soil_type, so unknown soils score as incompatible
+    compat_cols = soil_compat.soil_columns([r.soil_type for r in rows], m.soil_codes)
+    return features, compat_cols
+
+
+def _rank_crops(m: ModelRegistry, proba: np.ndarray, compat_cols: np.ndarray):
+    return soil_compat.rerank(proba, m.crop_soil_compat, compat_cols, CANDIDATE_POOL, TOP_K)
+
+
+def _format_ranked(m: ModelRegistry, top_idx, top_boosted, top_compat) -> List[list]:
+    return [
+        [_format_recommendation(m.crop_names[i], float(b), float(c))
+         for i, b, c in zip(top_idx[row], top_boosted[row], top_compat[row])]
+        for row in range(len(top_idx))
+    ]
+
+
+def _score_crop_rows(ref, rows: List[CropRecommendRequest]) -> List[list]:
+    """Score many fields at once: one model call over an (n, 9) matrix."""
+    m = _job_models(ref)
+    with metrics.stage("crop_encode"):
+        features, compat_cols = _crop_features(m, rows)
+    with metrics.stage("crop_predict_proba"):
+        proba = m.crop_batch_engine.predict_proba(features)
+    with metrics.stage("crop_rerank"):
+        ranked = _rank_crops(m, proba, compat_cols)
+    with metrics.stage("crop_format"):
+        return _format_ranked(m, *ranked)
+
+
+def _format_recommendation(crop_name: str, boosted_prob: float, compat: float) -> dict:
+    # Display confidence as boosted %, capped at 99%
+    confidence = min(round(boosted_prob * 100, 1), 99.0)
+    info = CROP_INFO.get(crop_name, {})
+    soil_match = soil_compat.match_label(compat)
+    return {
+        "crop": crop_name,
+        "confidence": confidence,
+        "soilCompatibility": soil_match,
+        "soilScore": round(compat * 100),
+        "expectedYield": CROP_YIELDS.get(crop_name, "N/A"),
+        "marketPrice": CROP_PRICES.get(crop_name, 2500),
+        "sowingPeriod": info.get("sowing", "N/A"),
+        "harvestTime": info.get("harvest", "N/A"),
+        "fertilizer": info.get("fertilizer", "NPK as recommended"),
+        "riskLevel": info.get("risk", "Medium"),
+    }
+
+
+def _quantize(req: CropRecommendRequest) -> CropRecommendRequest:
+    return req.model_copy(update={
+        field: round(round(getattr(req, field) / step) * step, 6)
+        for field, step in QUANTIZE_STEPS.items()
+    })
 
 
 @app.post("/api/recommend-crops")
-async def recommend_crops(req: CropRecommendRequest):
-    if crop_model is None:
+async def recommend_crops(req: CropRecommendRequest, request: Request):
+    if models is None:
+        raise HTTPException(status_code=503, detail="Models not loaded. Run train_models.py first.")
+    req = _quantize(req)
+
+    async def compute(m):
+        try:
+            results = await crop_batcher.submit((m, req))
+            return {
+                "recommendations": results,
+                "state": req.state,
+                "soilType": req.soil_type,
+                "status": "success"
+            }
+        except (HTTPException, ExecutorOverloaded, StaleModels):
+            raise
+        except Exception as e:
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=str(e))
+
+    key = tuple(getattr(req, f) for f in QUANTIZE_STEPS) + (req.state, req.season, req.soil_type)
+    return await _cached_response(request, "recommend-crops", key, compute)
+
+
+@app.get("/api/recommend-crops/batcher")
+async def recommend_crops_batcher_stats():
+    """Batch-size histogram and queue wait times for tuning the coalescing window."""
+    return crop_batcher.stats()
+
+
+@app.post("/api/recommend-crops/batch")
+async def recommend_crops_batch(req: CropBatchRequest):
+    """Score many fields (e.g. a cooperative's sensor sweep) in a single model call."""
+    m = models
+    if m is None:
         raise HTTPException(status_code=503, detail="Models not loaded. Run train_models.py first.")
+    if len(req.items) > MAX_BATCH_ROWS:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_ROWS} rows).")
+    if not req.items:
+        return {"results": [], "count": 0, "status": "success"}
     try:
-        # Encode state
-        known_states = list(state_encoder.classes_)
-        state_to_use = req.state if req.state in known_states else known_states[0]
-        state_enc_val = state_encoder.transform([state_to_use])[0]
-
-        # Encode soil_type
-        known_soils = list(soil_encoder.classes_) if soil_encoder else []
-        soil_to_use = req.soil_type if req.soil_type in known_soils else (known_soils[0] if known_soils else "Loamy")
-        soil_enc_val = soil_encoder.transform([soil_to_use])[0] if soil_encoder else 0
-
-        # Build feature vector: N, P, K, temperature, pH, moisture, state_enc, soil_type_enc, soil_compat
-        # soil_compat will be computed per-crop in post-processing, use 0.75 as neutral for initial prediction
-        features = np.array([[req.N, req.P, req.K, req.temperature, req.pH, req.moisture,
-                               state_enc_val, soil_enc_val, 0.75]])
-        features_scaled = crop_scaler.transform(features)
-        proba = crop_model.predict_proba(features_scaled)[0]
-
-        # Top 6 candidates; re-rank with soil compatibility boost
-        top6_idx = np.argsort(proba)[::-1][:6]
-        candidates = []
-        for idx in top6_idx:
-            crop_name = crop_encoder.inverse_transform([idx])[0]
-            base_prob = float(proba[idx])
-            compat = get_soil_compat(crop_name, req.soil_type)
-            # Boost probability by soil compatibility
-            boosted_prob = base_prob * (0.5 + 0.5 * compat)
-            candidates.append((crop_name, base_prob, boosted_prob, compat))
-
-        # Sort by boosted probability
-        candidates.sort(key=lambda x: x[2], reverse=True)
-        top4 = candidates[:4]
-
-        results = []
-        for crop_name, base_prob, boosted_prob, compat in top4:
-            # Display confidence as boosted %, capped at 99%
-            confidence = min(round(boosted_prob * 100, 1), 99.0)
-            info = CROP_INFO.get(crop_name, {})
-            soil_match = "✅ Best Match" if compat >= 1.0 else ("✓ Compatible" if compat >= 0.75 else "⚠ Sub-optimal")
-            results.append({
-                "crop": crop_name,
-                "confidence": confidence,
-                "soilCompatibility": soil_match,
-                "soilScore": round(compat * 100),
-                "expectedYield": CROP_YIELDS.get(crop_name, "N/A"),
-                "marketPrice": CROP_PRICES.get(crop_name, 2500),
-                "sowingPeriod": info.get("sowing", "N/A"),
-                "harvestTime": info.get("harvest", "N/A"),
-                "fertilizer": info.get("fertilizer", "NPK as recommended"),
-                "riskLevel": info.get("risk", "Medium"),
-            })
+        scored = await _run_model_job(m, _score_crop_rows, req.items)
         return {
-            "recommendations": results,
-            "state": req.state,
-            "soilType": req.soil_type,
+            "results": [
+                {"recommendations": recs, "state": item.state, "soilType": item.soil_type}
+                for item, recs in zip(req.items, scored)
+            ],
+            "count": len(scored),
             "status": "success"
         }
+    except (ExecutorOverloaded, StaleModels):
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/market-prices")
-async def market_prices(req: MarketPriceRequest):
-    if price_model is None:
-        raise HTTPException(status_code=503, detail="Price model not loaded.")
+def _crop_sweep(ref, base: CropRecommendRequest, axes: Dict[str, list], target: Optional[str],
+                crops: Optional[List[str]]) -> dict:
+    """Expand, score and summarize a what-if grid in one predict_proba call."""
+    m = _job_models(ref)
+    with metrics.stage("sweep_expand"):
+        base_features, compat_cols = _crop_features(m, [base])
+        grids = {name: np.asarray(values, dtype=float) for name, values in axes.items()}
+        features = sweep.expand_grid(base_features[0], grids)
+    boosted, top = sweep.score_grid(m.crop_engine, m.crop_soil_compat, features, int(compat_cols[0]),
+                                    CANDIDATE_POOL)
+
+    shape = [len(v) for v in grids.values()]
+    codes = {name: i for i, name in enumerate(m.crop_names)}
+    if crops is None:
+        shown = [int(c) for c in np.unique(top)]
+        if target is not None and codes[target] not in shown:
+            shown.append(codes[target])
+    else:
+        shown = [codes[c] for c in crops]
+    result = {
+        "axes": {name: values.tolist() for name, values in grids.items()},
+        "shape": shape,
+        "points": len(features),
+        "surfaces": {m.crop_names[c]: boosted[:, c].round(4).reshape(shape).tolist() for c in shown},
+        "topCrop": np.asarray(m.crop_names, dtype=object)[top].reshape(shape).tolist(),
+    }
+    if target is not None:
+        change = sweep.minimal_change(grids, {name: getattr(base, name) for name in grids}, top, codes[target])
+        if change is not None:
+            change["confidence"] = min(round(float(boosted[change.pop("index"), codes[target]]) * 100, 1), 99.0)
+        result["target"] = {"crop": target, "reachable": change is not None, **(change or {})}
+    return result
+
+
+@app.post("/api/recommend-crops/sweep")
+async def recommend_crops_sweep(req: CropSweepRequest):
+    """What-if analysis: score every combination of the varied inputs around a base field."""
+    m = models
+    if m is None:
+        raise HTTPException(status_code=503, detail="Models not loaded. Run train_models.py first.")
+    unknown = sorted(set(req.vary) - set(sweep.FEATURE_COLUMNS))
+    if not req.vary or unknown:
+        raise HTTPException(status_code=422, detail={
+            "error": f"vary must name one or more of {', '.join(sweep.FEATURE_COLUMNS)}", "invalid": unknown})
+    unknown = [c for c in (req.crops or []) + ([req.target_crop] if req.target_crop else [])
+               if c not in m.crop_names]
+    if unknown:
+        raise HTTPException(status_code=422, detail={"error": "unknown crop", "invalid": unknown})
+    axes = {name: axis.grid() for name, axis in req.vary.items()}
+    points = math.prod(len(values) for values in axes.values())   # Python ints: no int64 wraparound
+    if points > MAX_SWEEP_POINTS:
+        raise HTTPException(status_code=413, detail=f"Sweep too large ({points} points, max {MAX_SWEEP_POINTS}).")
+    try:
+        result = await _run_model_job(m, _crop_sweep, req.base, axes, req.target_crop, req.crops)
+        return {"base": req.base.model_dump(), **result, "status": "success"}
+    except (ExecutorOverloaded, StaleModels):
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _build_atlas(ref) -> atlas.Atlas:
+    m = _job_models(ref)
+    return atlas.build_atlas(m.crop_engine, m.crop_soil_compat, m.crop_names, m.state_codes, m.soil_codes,
+                             m.soil_profiles, m.weather_table, CANDIDATE_POOL, TOP_K)
+
+
+@app.get("/api/suitability-atlas")
+async def suitability_atlas(request: Request, state: Optional[str] = None, season: Optional[str] = None,
+                            soil_type: Optional[str] = None):
+    """Every state × soil type × season cell as NDJSON, precomputed per model version."""
+    m = models
+    if m is None:
+        raise HTTPException(status_code=503, detail="Models not loaded. Run train_models.py first.")
+    if m.atlas is None:
+        raise HTTPException(status_code=503, detail="Suitability atlas is still being built.",
+                            headers={"Retry-After": "5"})
+    if season is not None and season not in atlas.SEASON_MONTHS:
+        raise HTTPException(status_code=422, detail=f"season must be one of {', '.join(atlas.SEASON_MONTHS)}")
+    # The atlas only changes with the model version, so dashboards can revalidate cheaply
+    etag = f'"{m.version[:16]}"'
+    headers = {"ETag": etag, "X-Model-Version": m.version}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(m.atlas.stream(state, season, soil_type), media_type="application/x-ndjson",
+                             headers=headers)
+
+
+def _forecast_phases(ref, crop_enc_val: int, state_enc_val: int, lags: tuple, now: datetime.datetime) -> list:
+    """Live 4-phase rollout for one pair (fallback when the precomputed table misses)."""
+    m = _job_models(ref)
+    prices = forecast.rollout(m.price_engine, np.array([crop_enc_val]), np.array([state_enc_val]),
+                              np.array([lags], dtype=float), now, FORECAST_SEED)[0]
+    return forecast.format_phases(lags[0], prices)
+
+
+def _forecast_quantiles(ref, crop_enc_val: int, state_enc_val: int, lags: tuple,
+                        now: datetime.datetime) -> np.ndarray:
+    """Live (MAX_HORIZON, n_quantiles) grid for one pair (fallback when the precomputed table misses)."""
+    m = _job_models(ref)
+    return forecast.quantile_grid(m.price_quantiles, np.array([crop_enc_val]), np.array([state_enc_val]),
+                                  np.array([lags], dtype=float), now)[0]
+
+
+def _build_forecast_table(ref, now: datetime.datetime) -> forecast.ForecastTable:
+    m = _job_models(ref)
+    return forecast.build_table(m.price_engine, m.price_crop_codes, m.price_state_codes,
+                                m.lag_table, now, FORECAST_SEED,
+                                quantile_model=m.price_quantiles)
+
+
+def _requested_quantiles(m: ModelRegistry, req: MarketPriceRequest) -> Optional[list]:
+    """Quantile levels to report, or None when the request didn't ask and no quantile model is loaded."""
+    wants = req.horizon is not None or req.quantiles is not None
+    if m.price_quantiles is None:
+        if wants:
+            raise HTTPException(status_code=503, detail="Quantile price models not trained; run train_models.py.")
+        return None
+    trained = m.price_quantiles.quantiles
+    if req.quantiles is None:
+        return list(trained)
+    out_of_range = [q for q in req.quantiles if not trained[0] <= q <= trained[-1]]
+    if out_of_range or not req.quantiles:
+        raise HTTPException(status_code=422, detail={
+            "error": f"quantiles must be within the trained range [{trained[0]}, {trained[-1]}]",
+            "invalid": out_of_range,
+        })
+    quantiles = sorted(set(req.quantiles))
+    labels = [forecast.quantile_label(q) for q in quantiles]
+    if len(set(labels)) < len(labels):
+        raise HTTPException(status_code=422, detail={
+            "error": "quantiles must differ in their response labels (p followed by the percentage)",
+            "invalid": [q for q, label in zip(quantiles, labels) if labels.count(label) > 1],
+        })
+    return quantiles
+
+
+async def _market_prices_payload(m: ModelRegistry, req: MarketPriceRequest) -> dict:
+    quantiles = _requested_quantiles(m, req)
     try:
-        known_crops = list(price_crop_enc.classes_)
-        known_states = list(price_state_enc.classes_)
-        
-        crop_to_use = req.crop_name if req.crop_name in known_crops else known_crops[0]
-        state_to_use = req.state if req.state in known_states else known_states[0]
-
-        crop_enc_val = price_crop_enc.transform([crop_to_use])[0]
-        state_enc_val = price_state_enc.transform([state_to_use])[0]
-
-        # Get lag values from cache
-        cache_row = lag_cache[
-            (lag_cache['crop_name'] == crop_to_use) &
-            (lag_cache['state'] == state_to_use)
-        ]
-        if cache_row.empty:
-            cache_row = lag_cache[(lag_cache['crop_name'] == crop_to_use)].head(1)
-
-        if cache_row.empty:
-            raise HTTPException(status_code=404, detail=f"No data for crop: {req.crop_name}")
-
-        base_price = float(cache_row['avg_price_rs_quintal'].values[0])
-        lag1 = float(cache_row['lag1'].values[0])
-        lag3 = float(cache_row['lag3'].values[0])
-        lag6 = float(cache_row['lag6'].values[0])
-        lag12 = float(cache_row['lag12'].values[0])
-
-        import datetime
+        with metrics.stage("price_encode"):
+            crop_to_use = req.crop_name if req.crop_name in m.price_crop_codes else m.price_crop_enc.classes_[0]
+            state_to_use = req.state if req.state in m.price_state_codes else m.price_state_enc.classes_[0]
+
         now = datetime.datetime.now()
-        phases = []
-        current_price = base_price
-        prev_price = lag1
-
-        for phase in range(4):  # 4 x 15-day phases
-            future_month = (now.month + phase) % 12 + 1
-            future_year = now.year + ((now.month + phase) // 12)
-
-            X_pred = np.array([[crop_enc_val, state_enc_val, future_year, future_month,
-                                 prev_price, lag3, lag6, lag12]])
-            predicted = float(price_model.predict(X_pred)[0])
-
-            # Apply small realistic noise ±2%
-            noise = predicted * np.random.uniform(-0.02, 0.02)
-            predicted = max(500, predicted + noise)
-
-            trend = "up" if predicted > current_price else ("down" if predicted < current_price * 0.99 else "stable")
-            phases.append({
-                "phase": phase + 1,
-                "label": f"Days {phase*15+1}–{phase*15+15}",
-                "price": round(predicted),
-                "trend": trend,
-                "confidence": round(90 - phase * 5),  # Decreasing confidence over time
-            })
-            prev_price = predicted
-            current_price = predicted
+        table = m.forecast_table
+        current = table is not None and table.is_current(now)
+        with metrics.stage("forecast_table_lookup"):
+            entry = table.get(crop_to_use, state_to_use) if current else None
+            grid = table.get_grid(crop_to_use, state_to_use) if current and quantiles is not None else None
+        lags = None
+        if entry is None or (quantiles is not None and grid is None):
+            # Get lag values from cache
+            with metrics.stage("lag_lookup"):
+                lags = m.lags(crop_to_use, state_to_use)
+            if lags is None:
+                raise HTTPException(status_code=404, detail=f"No data for crop: {req.crop_name}")
+        crop_code, state_code = m.price_crop_codes[crop_to_use], m.price_state_codes[state_to_use]
+        if entry is not None:
+            base_price, phases = entry
+        else:
+            base_price = lags[0]
+            phases = await _run_model_job(m, _forecast_phases, crop_code, state_code, lags, now)
 
-        return {
+        payload = {
             "crop": req.crop_name,
             "state": req.state,
             "basePrice": round(base_price),
@@ -294,37 +708,337 @@ async def market_prices(req: MarketPriceRequest):
             "currency": "INR",
             "unit": "per quintal"
         }
-    except HTTPException:
+        if quantiles is not None:
+            if grid is None:
+                grid = await _run_model_job(m, _forecast_quantiles, crop_code, state_code, lags, now)
+            horizon = req.horizon or m.price_quantiles.max_horizon
+            grid = forecast.interpolate_quantiles(grid[:horizon], m.price_quantiles.quantiles, quantiles)
+            payload["horizons"] = forecast.format_horizons(base_price, grid, quantiles, now)
+        return payload
+    except (HTTPException, ExecutorOverloaded, StaleModels):
         raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/market-prices")
+async def market_prices(req: MarketPriceRequest, request: Request):
+    if models is None:
+        raise HTTPException(status_code=503, detail="Price model not loaded.")
+    quantiles = None if req.quantiles is None else tuple(req.quantiles)
+    key = (req.crop_name, req.state, req.horizon, quantiles, datetime.date.today().isoformat())
+    return await _cached_response(request, "market-prices", key, lambda m: _market_prices_payload(m, req))
+
+
 @app.post("/api/weather-analysis")
-async def weather_analysis(req: WeatherRequest):
-    if weather_lookup is None:
+async def weather_analysis(req: WeatherRequest, request: Request):
+    if models is None:
         raise HTTPException(status_code=503, detail="Weather data not loaded.")
-    try:
-        row = weather_lookup[
-            (weather_lookup['state'] == req.state) &
-            (weather_lookup['month'] == req.month)
-        ]
-        if row.empty:
-            row = weather_lookup[weather_lookup['month'] == req.month].head(1)
-        if row.empty:
+
+    async def compute(m):
+        with metrics.stage("weather_lookup"):
+            record = m.weather(req.state, req.month)
+        if record is None:
             raise HTTPException(status_code=404, detail="No weather data found")
-        r = row.iloc[0]
-        return {
-            "state": req.state,
-            "month": req.month,
-            "avgTemp": round(float(r['avg_temp']), 1),
-            "avgRainfall": round(float(r['avg_rainfall']), 1),
-            "avgHumidity": round(float(r['avg_humidity']), 1),
-            "recentTemp": round(float(r.get('recent_temp', r['avg_temp'])), 1),
-            "recentRainfall": round(float(r.get('recent_rainfall', r['avg_rainfall'])), 1),
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return {"state": req.state, "month": req.month, **record}
+
+    return await _cached_response(request, "weather-analysis", (req.state, req.month), compute)
+
+
+@app.get("/api/weather-history")
+async def get_weather_history(state: str, start: Optional[str] = None, end: Optional[str] = None,
+                              measures: Optional[str] = None, stats: Optional[str] = None, window: int = 12):
+    """Monthly series for one state over [start, end] ("YYYY-MM", inclusive) with optional statistics.
+
+    measures: comma-separated temperature, rainfall, humidity, wind (default: all)
+    stats:    comma-separated rolling (window months), anomaly, yoy, percentile
+    """
+    m = models
+    if m is None:
+        raise HTTPException(status_code=503, detail="Models not loaded. Run train_models.py first.")
+    if m.weather_history is None:
+        raise HTTPException(status_code=503, detail="Weather history not built. Run train_models.py first.")
+    names = [n.strip() for n in measures.split(",") if n.strip()] if measures else list(weather_history.MEASURES)
+    wanted = [n.strip() for n in stats.split(",") if n.strip()] if stats else []
+    invalid = [n for n in names if n not in weather_history.MEASURES] + \
+              [n for n in wanted if n not in weather_history.STATS]
+    if invalid:
+        raise HTTPException(status_code=422, detail={
+            "error": f"measures: {', '.join(weather_history.MEASURES)}; stats: {', '.join(weather_history.STATS)}",
+            "invalid": invalid})
+    if not 1 <= window <= 600:
+        raise HTTPException(status_code=422, detail="window must be between 1 and 600 months")
+    try:
+        start_idx = weather_history.parse_month(start) if start else None
+        end_idx = weather_history.parse_month(end) if end else None
+    except ValueError:
+        raise HTTPException(status_code=422, detail="start / end must be YYYY-MM")
+
+    with metrics.stage("weather_history_query"):
+        result = m.weather_history.query(state, start_idx, end_idx, names, wanted, window)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"No weather history for state: {state}")
+    return {"state": state, "start": start, "end": end, "window": window if "rolling" in wanted else None, **result}
+
+
+def _get_sensor_store() -> SensorStore:
+    global sensor_store
+    with _sensor_store_lock:   # concurrent first uploads must not each build an engine
+        if sensor_store is None:
+            sensor_store = SensorStore(os.getenv("DATABASE_URL"), pool_size=SENSOR_MAX_WRITERS)
+    return sensor_store
+
+
+async def _ingest_ndjson(request: Request, store: SensorStore):
+    """Stream NDJSON rows, writing every SENSOR_CHUNK_ROWS so memory stays bounded.
+    Chunks already written stay committed if a later line fails validation."""
+    inserted, latest, rows, pending, line_no = 0, {}, [], b"", 0
+
+    def parse(line: bytes):
+        try:
+            rows.append(SensorReading.model_validate_json(line))
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail={
+                "line": line_no, "inserted": inserted,
+                "errors": e.errors(include_url=False, include_context=False, include_input=False),
+            })
+
+    async def flush():
+        nonlocal inserted, rows
+        cols = stamp_missing(rows_to_columns(rows))
+        inserted += await asyncio.to_thread(store.write, cols)
+        latest_per_user(cols, latest)
+        rows = []
+
+    def check_length(line: bytes):
+        if len(line) > SENSOR_MAX_LINE_BYTES:
+            raise HTTPException(status_code=413, detail={
+                "line": line_no + 1, "inserted": inserted,
+                "error": f"Line too long (max {SENSOR_MAX_LINE_BYTES} bytes).",
+            })
+
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            check_length(line)
+            line_no += 1
+            if line.strip():
+                parse(line)
+        check_length(pending)   # an unterminated line must not buffer without limit
+        if len(rows) >= SENSOR_CHUNK_ROWS:
+            await flush()
+    if pending.strip():
+        line_no += 1
+        parse(pending)
+    if rows:
+        await flush()
+    return inserted, latest
+
+
+async def _recommend_for_latest(store: SensorStore, latest: dict) -> dict:
+    """Batch crop recommendation over each user's latest reading, using farm_profiles for state/soil."""
+    profiles = await asyncio.to_thread(store.profiles, list(latest))
+    users, items = [], []
+    for user, r in latest.items():
+        if user not in profiles:
+            continue
+        state, soil_type = profiles[user]
+        users.append(user)
+        items.append(CropRecommendRequest(
+            N=r["nitrogen"], P=r["phosphorus"], K=r["potassium"], temperature=r["temperature"],
+            pH=r["ph_level"], moisture=r["soil_moisture"], state=state, soil_type=soil_type or "Loamy",
+        ))
+    m = models
+    scored = await _run_model_job(m, _score_crop_rows, items) if items and m is not None else []
+    return {
+        "results": [{"userId": u, "recommendations": recs} for u, recs in zip(users, scored)],
+        "unprofiledUsers": sorted(set(latest) - set(profiles)),
+    }
+
+
+@app.post("/api/sensor-readings/bulk")
+async def sensor_readings_bulk(request: Request, recommend: bool = False):
+    """Bulk-insert IoT readings. Body is a columnar JSON batch, or NDJSON rows
+    (Content-Type: application/x-ndjson) streamed and committed in chunks.
+    With ?recommend=true, also scores each user's latest complete reading."""
+    if _sensor_writers.locked():
+        raise HTTPException(status_code=503, detail="Too many concurrent sensor uploads, retry shortly.",
+                            headers={"Retry-After": "1"})
+    async with _sensor_writers:
+        try:
+            store = await asyncio.to_thread(_get_sensor_store)
+            if "ndjson" in request.headers.get("content-type", ""):
+                inserted, latest = await _ingest_ndjson(request, store)
+            else:
+                try:
+                    batch = SensorReadingsBatch.model_validate_json(await request.body())
+                except ValidationError as e:
+                    raise RequestValidationError(e.errors(include_url=False))
+                if len(batch.user_id) > SENSOR_MAX_ROWS:
+                    raise HTTPException(status_code=413,
+                                        detail=f"Batch too large (max {SENSOR_MAX_ROWS} rows); use NDJSON streaming.")
+                cols = stamp_missing(batch.columns())
+                inserted = 0
+                for chunk in column_chunks(cols, SENSOR_CHUNK_ROWS):
+                    inserted += await asyncio.to_thread(store.write, chunk)
+                latest = latest_per_user(cols)
+
+            result = {"inserted": inserted, "status": "success"}
+            if recommend:
+                result["recommendations"] = await _recommend_for_latest(store, latest)
+            return result
+        except (HTTPException, RequestValidationError, ExecutorOverloaded, StaleModels):
+            raise
+        except Exception as e:
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+# ─── Hot model reload ───────────────────────────────────────
+_reload_lock = asyncio.Lock()
+
+# Fixed agronomic inputs for the smoke set, crossed with a few known and unknown states / soils
+SMOKE_INPUTS = [
+    (90, 42, 43, 24.5, 6.5, 80.0),
+    (20, 60, 20, 18.0, 7.2, 35.0),
+    (120, 30, 60, 32.0, 5.8, 60.0),
+]
+
+
+def _smoke_test(m: ModelRegistry) -> dict:
+    """Run a fixed smoke set through a candidate registry before it serves traffic (raises on failure)."""
+    states = list(m.state_codes)[:3] + ["Unknown State"]
+    soils = list(m.soil_codes)[:3] + ["Unknown Soil"]
+    rows = [CropRecommendRequest(N=n, P=p, K=k, temperature=t, pH=ph, moisture=mo, state=state, soil_type=soil)
+            for n, p, k, t, ph, mo in SMOKE_INPUTS for state in states for soil in soils]
+    proba = np.asarray(m.crop_engine.predict_proba(_crop_features(m, rows)[0]))
+    if proba.shape != (len(rows), len(m.crop_names)):
+        raise ValueError(f"crop model returned {proba.shape}, expected {(len(rows), len(m.crop_names))}")
+    if not np.isfinite(proba).all() or not np.allclose(proba.sum(axis=1), 1.0, atol=1e-6):
+        raise ValueError("crop model probabilities are not finite / do not sum to 1")
+    if any(not recs for recs in _score_crop_rows(m, rows)):
+        raise ValueError("crop re-ranking returned an empty recommendation list")
+
+    crops, states = (codes[:50] for codes in m.lag_table.pairs())
+    if not len(crops):
+        raise ValueError("price lag table is empty")
+    lags = m.lag_table.values[crops, states].astype(float)
+    now = datetime.datetime.now()
+    prices = forecast.rollout(m.price_engine, crops, states, lags, now, FORECAST_SEED)
+    if not np.isfinite(prices).all():
+        raise ValueError("price model produced non-finite forecasts")
+    if m.price_quantiles is not None:
+        grid = forecast.quantile_grid(m.price_quantiles, crops, states, lags, now)
+        if not np.isfinite(grid).all():
+            raise ValueError("quantile price models produced non-finite forecasts")
+    if not len(m.weather_table):
+        raise ValueError("weather lookup is empty")
+    return {"cropRows": len(rows), "pricePairs": len(crops), "weatherRecords": len(m.weather_table)}
+
+
+async def reload_models(reason: str, force: bool = False) -> dict:
+    """Load models/saved into a new registry, smoke-test it and swap it in.
+
+    On any failure the current registry keeps serving untouched. In-flight
+    requests finish on the snapshot they started with.
+    """
+    global models, previous_models, last_reload
+    async with _reload_lock:
+        current = models
+        fingerprint = await asyncio.to_thread(artifact_fingerprint, MODELS_DIR)
+        if not force and current is not None and fingerprint == current.fingerprint:
+            return {"status": "unchanged", "version": current.version}
+        result = {"reason": reason, "at": datetime.datetime.now().isoformat(timespec="seconds"),
+                  "fingerprint": fingerprint, "previous": current.version if current else None}
+        try:
+            candidate = await asyncio.to_thread(load_registry, MODELS_DIR, MODEL_FORMAT,
+                                                INFERENCE_ENGINE, CROP_SKLEARN_BATCH_ROWS)
+            result["smoke"] = await asyncio.to_thread(_smoke_test, candidate)
+            table = await asyncio.to_thread(_build_forecast_table, candidate, datetime.datetime.now())
+            built = await asyncio.to_thread(_build_atlas, candidate)
+            candidate = candidate.replace(forecast_table=table, atlas=built)
+        except Exception as e:
+            traceback.print_exc()
+            last_reload = {**result, "status": "rejected", "error": str(e)}
+            print(f"⚠️  Model reload rejected, still serving {result['previous']}: {e}")
+            return last_reload
+
+        previous_models, models = current, candidate
+        if executor.mode == "process":
+            executor.restart()  # new workers load the same artifacts from disk
+        response_cache.invalidate()
+        last_reload = {**result, "status": "swapped", "version": candidate.version, "loadMs": candidate.load_ms}
+        print(f"✓ Models hot-reloaded from {candidate.source} in {candidate.load_ms} ms ({reason})")
+        return last_reload
+
+
+async def _watch_models():
+    """Poll models/saved; reload once a changed fingerprint is stable across two polls."""
+    pending, rejected = None, None
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL)
+        try:
+            fingerprint = await asyncio.to_thread(artifact_fingerprint, MODELS_DIR)
+            current = models
+            if (current is not None and fingerprint == current.fingerprint) or fingerprint == rejected:
+                pending = None
+            elif fingerprint != pending:
+                pending = fingerprint  # still being written? wait one more interval
+            else:
+                pending = None
+                result = await reload_models("watcher")
+                if result["status"] == "rejected":
+                    rejected = result["fingerprint"]
+        except Exception:
+            traceback.print_exc()
+
+
+def _require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model admin endpoints are disabled (set ADMIN_TOKEN).")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
+
+
+def _describe(m: Optional[ModelRegistry]) -> Optional[dict]:
+    if m is None:
+        return None
+    return {"version": m.version, "source": m.source, "loadMs": m.load_ms, "engine": m.inference_engine,
+            "lookupTableBytes": m.lag_table.nbytes + m.weather_table.nbytes}
+
+
+@app.get("/api/admin/models")
+async def model_status(request: Request):
+    """Serving and previous model versions plus the outcome of the last reload."""
+    _require_admin(request)
+    return {"current": _describe(models), "previous": _describe(previous_models), "lastReload": last_reload,
+            "watchInterval": MODEL_WATCH_INTERVAL}
+
+
+@app.post("/api/admin/models/reload")
+async def admin_reload_models(request: Request, force: bool = False):
+    """Hot-reload models/saved (no-op if unchanged unless force=true)."""
+    _require_admin(request)
+    result = await reload_models("admin", force=force)
+    if result["status"] == "rejected":
+        raise HTTPException(status_code=422, detail=result)
+    return result
+
+
+@app.post("/api/admin/models/rollback")
+async def admin_rollback_models(request: Request):
+    """Swap back to the registry that served before the last reload."""
+    global models, previous_models
+    _require_admin(request)
+    async with _reload_lock:
+        if previous_models is None:
+            raise HTTPException(status_code=409, detail="No previous model version to roll back to.")
+        if executor.mode == "process":
+            raise HTTPException(status_code=409,
+                                detail="Rollback needs INFERENCE_EXECUTOR=thread (process workers load from disk).")
+        models, previous_models = previous_models, models
+        response_cache.invalidate()
+        print(f"✓ Models rolled back to {models.source}")
+        return {"status": "rolled_back", "current": _describe(models), "previous": _describe(previous_models)}
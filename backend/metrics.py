@@ -0,0 +1,284 @@
+"""
+Low-overhead request and pipeline-stage metrics in the Prometheus text format.
+
+  metrics.stage("predict_proba")   context manager timing one pipeline stage
+  MetricsMiddleware                ASGI middleware: per-route latency histogram,
+                                   request counts by status, in-flight gauge
+  loop_lag_monitor()               background task sampling event-loop lag
+  SamplingProfiler                 opt-in stack sampler; dumps collapsed stacks
+                                   (flamegraph.pl / speedscope) for slow requests
+
+Stage timings recorded inside INFERENCE_EXECUTOR=process workers stay in those
+workers; use the thread executor when profiling the scoring stages.
+"""
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STAGE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, as Prometheus expects."""
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}   # labels -> [bucket counts..., +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += seconds
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {k: list(v) for k, v in self._series.items()}
+        for key, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(key)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(key)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{_labels(k)} {v}" for k, v in sorted(self._values.items())]
+        return lines
+
+
+class Gauge:
+    """Either set() directly or backed by a callback evaluated at scrape time."""
+
+    def __init__(self, name: str, help_text: str, fn: Optional[Callable[[], Dict[tuple, float]]] = None):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self._values: Dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[tuple(sorted(labels.items()))] = value
+
+    def add(self, amount: float, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        values = self.fn() if self.fn is not None else dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        lines += [f"{self.name}{_labels(k)} {v}" for k, v in sorted(values.items()) if v is not None]
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+request_seconds = registry.register(Histogram(
+    "crop_advisor_request_duration_seconds", "HTTP request latency by route and method."))
+requests_total = registry.register(Counter(
+    "crop_advisor_requests_total", "HTTP requests by route, method and status."))
+in_flight = registry.register(Gauge(
+    "crop_advisor_requests_in_flight", "HTTP requests currently being served."))
+in_flight.set(0)
+stage_seconds = registry.register(Histogram(
+    "crop_advisor_stage_duration_seconds", "Time spent in each request-pipeline stage.", STAGE_BUCKETS))
+loop_lag_seconds = registry.register(Histogram(
+    "crop_advisor_event_loop_lag_seconds", "Delay of a periodic event-loop wakeup past its deadline.",
+    LOOP_LAG_BUCKETS))
+
+
+@contextmanager
+def stage(name: str):
+    """Time one pipeline stage into crop_advisor_stage_duration_seconds{stage=name}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=name)
+
+
+# ─── HTTP middleware ────────────────────────────────────────
+class MetricsMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware task/queue overhead).
+
+    X-Profile: 1 forces a profile dump only together with X-Admin-Token
+    matching `profile_token`; without a token the header is ignored.
+    """
+
+    def __init__(self, app, profiler: Optional["SamplingProfiler"] = None, profile_token: Optional[str] = None):
+        self.app = app
+        self.profiler = profiler
+        self.profile_token = profile_token
+
+    def _profile_forced(self, headers) -> bool:
+        if not self.profile_token or (b"x-profile", b"1") not in headers:
+            return False
+        token = next((v for k, v in headers if k == b"x-admin-token"), b"")
+        return hmac.compare_digest(token, self.profile_token.encode())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight.add(1)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end = time.perf_counter()
+            in_flight.add(-1)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            request_seconds.observe(end - start, route=path, method=method)
+            requests_total.inc(route=path, method=method, status=str(status))
+            if self.profiler is not None:
+                forced = self._profile_forced(scope.get("headers", ()))
+                self.profiler.maybe_dump(start, end, path, forced)
+
+
+# ─── Event-loop lag ─────────────────────────────────────────
+async def loop_lag_monitor(interval: float = 0.25):
+    """Sleep `interval` repeatedly; any overshoot is time the loop spent blocked."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag_seconds.observe(max(0.0, time.perf_counter() - start - interval))
+
+
+# ─── Sampling profiler ──────────────────────────────────────
+class SamplingProfiler:
+    """Samples every thread's stack each `interval_ms` into a bounded ring buffer.
+
+    When a request takes longer than `slow_ms` (or is forced by an admin's
+    `X-Profile: 1`), the samples taken while it ran are written as collapsed
+    stacks ("frame;frame;frame count" lines) to out_dir, ready for
+    flamegraph.pl or speedscope. Dumps are written on a writer thread, never
+    on the event loop.
+    """
+
+    def __init__(self, out_dir: str, slow_ms: float, interval_ms: float = 5.0, max_samples: int = 20000,
+                 max_dumps: int = 100):
+        self.out_dir = out_dir
+        self.slow = slow_ms / 1000.0
+        self.interval = interval_ms / 1000.0
+        self.max_dumps = max_dumps
+        self._samples: deque = deque(maxlen=max_samples)   # (timestamp, collapsed stack)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self.dumps = 0
+
+    def start(self):
+        if self._thread is None:
+            os.makedirs(self.out_dir, exist_ok=True)
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)   # let queued dumps finish
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._samples.append((now, ";".join(reversed(stack))))
+
+    def maybe_dump(self, start: float, end: float, route: str, forced: bool = False) -> Optional[Future]:
+        """Queue a dump of the samples between start and end; the future resolves to the path (or None)."""
+        if self._thread is None or self.dumps >= self.max_dumps or not (forced or end - start >= self.slow):
+            return None
+        self.dumps += 1
+        return self._writer.submit(self._write, start, end, route)
+
+    def _write(self, start: float, end: float, route: str) -> Optional[str]:
+        counts: Dict[str, int] = {}
+        for ts, stack in list(self._samples):
+            if start <= ts <= end:
+                counts[stack] = counts.get(stack, 0) + 1
+        if not counts:
+            return None
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{route.strip('/').replace('/', '_') or 'root'}-" \
+               f"{(end - start) * 1000:.0f}ms.folded"
+        path = os.path.join(self.out_dir, name)
+        with open(path, "w") as f:
+            for stack, count in sorted(counts.items()):
+                f.write(f"{stack} {count}\n")
+        print(f"⚠️  Slow request {route} ({(end - start) * 1000:.0f} ms): profile written to {path}")
+        return path
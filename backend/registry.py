@@ -0,0 +1,249 @@
+"""
+Immutable model registry.
+Every encoder, model and lookup table the API serves from lives on one frozen
+ModelRegistry. main.py holds a single reference to the current registry and
+swaps it with one assignment on reload, so a request that took a snapshot
+at its start never mixes an old encoder with a new model.
+"""
+import dataclasses
+import hashlib
+import json
+import math
+import os
+import time
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, Tuple
+
+import numpy as np
+
+import soil_compat
+import tree_engine
+from bundle import ModelBundle, find_bundle
+from tables import LagTable, WeatherTable
+from weather_history import WeatherHistory
+
+
+class StaleModels(Exception):
+    """A process-pool worker holds a different model version than the request's snapshot."""
+
+
+@dataclasses.dataclass(frozen=True)
+class ModelRegistry:
+    version: str               # bundle version, or a fingerprint of the pickles
+    fingerprint: str           # artifact_fingerprint() of models_dir when loaded
+    source: str                # "bundle <version>" or "pickle"
+    load_ms: float
+    inference_engine: str      # "compiled" or "sklearn"
+
+    crop_model: Any
+    crop_scaler: Any
+    state_encoder: Any
+    soil_encoder: Any
+    crop_encoder: Any
+    price_model: Any
+    price_crop_enc: Any
+    price_state_enc: Any
+    soil_types_data: Optional[dict]
+    soil_profiles: Optional[dict]        # {"national": {...}, "states": {state: {N, P, K, pH, moisture}}}
+    crop_engine: Any           # raw features -> class probabilities (scaler included)
+    crop_batch_engine: Any     # crop_engine, or a RoutedClassifier for client batches (CROP_SKLEARN_BATCH_ROWS)
+    price_engine: Any          # price features -> predicted price
+    price_quantiles: Any       # horizon features -> (n, n_quantiles) price ratios, or None if not trained
+
+    crop_names: Tuple[str, ...]          # crop code -> name (crop_encoder.classes_)
+    crop_soil_compat: np.ndarray         # (n_crops, n_soils + 1); last column = unknown soil
+    state_codes: Mapping[str, int]       # state -> state_encoder code
+    soil_codes: Mapping[str, int]        # soil_type -> soil_encoder code
+    price_crop_codes: Mapping[str, int]  # crop -> price_crop_enc code
+    price_state_codes: Mapping[str, int] # state -> price_state_enc code
+    lag_table: LagTable                  # (price crop code, price state code) -> lags, memory-mapped
+    weather_table: WeatherTable          # (weather state, month) -> weather means, memory-mapped
+    weather_history: Optional[WeatherHistory]  # full monthly series per state, memory-mapped
+    forecast_table: Any = None           # forecast.ForecastTable for this version, rebuilt nightly
+    atlas: Any = None                    # atlas.Atlas for this version, built on load / reload
+
+    def replace(self, **changes) -> "ModelRegistry":
+        return dataclasses.replace(self, **changes)
+
+    def lags(self, crop: str, state: str) -> Optional[tuple]:
+        """(base_price, lag1, lag3, lag6, lag12); unseen states use the crop's first cached row."""
+        crop_code = self.price_crop_codes.get(crop)
+        if crop_code is None:
+            return None
+        return self.lag_table.lags(crop_code, self.price_state_codes.get(state))
+
+    def weather(self, state: str, month: int) -> Optional[dict]:
+        """Response-ready weather record; unseen states use the first state with data for that month."""
+        row = self.weather_table.row(state, month)
+        if row is None:
+            return None
+        avg_temp, avg_rainfall, avg_humidity, _, recent_temp, recent_rainfall, _ = (float(v) for v in row)
+        return {
+            "avgTemp": round(avg_temp, 1),
+            "avgRainfall": round(avg_rainfall, 1),
+            "avgHumidity": round(avg_humidity, 1),
+            "recentTemp": round(avg_temp if math.isnan(recent_temp) else recent_temp, 1),
+            "recentRainfall": round(avg_rainfall if math.isnan(recent_rainfall) else recent_rainfall, 1),
+        }
+
+
+# ─── Index builders ─────────────────────────────────────────
+def _code_index(encoder) -> MappingProxyType:
+    return MappingProxyType({str(c): i for i, c in enumerate(encoder.classes_)})
+
+
+# ─── Loading ────────────────────────────────────────────────
+def artifact_fingerprint(models_dir: str) -> str:
+    """Cheap change detector: names, sizes and mtimes of the saved artifacts."""
+    h = hashlib.sha256()
+    paths = [os.path.join(models_dir, name) for name in sorted(os.listdir(models_dir))] \
+        if os.path.isdir(models_dir) else []
+    bundle_path = find_bundle(models_dir)
+    if bundle_path:
+        paths.append(os.path.join(bundle_path, "bundle.json"))
+    for path in paths:
+        if os.path.isfile(path):
+            st = os.stat(path)
+            h.update(f"{os.path.relpath(path, models_dir)}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()
+
+def _load_from_pickles(models_dir: str) -> dict:
+    """Original artifacts: joblib pickles (imports sklearn) + memory-mapped lookup tables."""
+    import joblib
+
+    def load(name):
+        return joblib.load(os.path.join(models_dir, name))
+
+    def load_json(name):
+        path = os.path.join(models_dir, name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    price_quantiles = None
+    if os.path.exists(os.path.join(models_dir, "price_quantile_models.pkl")):
+        price_quantiles = load("price_quantile_models.pkl")
+
+    return {
+        "source": "pickle",
+        "version": None,
+        "crop_model": load("crop_model.pkl"),
+        "crop_scaler": load("crop_scaler.pkl"),
+        "state_encoder": load("state_encoder.pkl"),
+        "soil_encoder": load("soil_encoder.pkl"),
+        "crop_encoder": load("crop_encoder.pkl"),
+        "soil_types_data": load_json("soil_types.json"),
+        "soil_profiles": load_json("soil_profiles.json"),
+        "price_model": load("price_model.pkl"),
+        "price_crop_enc": load("price_crop_encoder.pkl"),
+        "price_state_enc": load("price_state_encoder.pkl"),
+        "price_quantiles": price_quantiles,   # {"quantiles", "max_horizon", "models"} from train_models.py
+        "lag_table": LagTable.load(models_dir),
+        "weather_table": WeatherTable.load(models_dir),
+        "weather_history": WeatherHistory.load(models_dir) if WeatherHistory.available(models_dir) else None,
+    }
+
+def _load_from_bundle(path: str) -> dict:
+    """Fast-start bundle: JSON vocabularies + memory-mapped numpy arrays, no pandas."""
+    bundle = ModelBundle(path)
+    return {
+        "source": f"bundle {bundle.version[:12]}",
+        "version": bundle.version,
+        "crop_model": bundle.crop_model(),
+        "load_sklearn_crop": bundle.sklearn_crop_model,   # (models_dir) -> RandomForestClassifier
+        "crop_scaler": bundle.crop_scaler(),
+        "state_encoder": bundle.encoder("state"),
+        "soil_encoder": bundle.encoder("soil"),
+        "crop_encoder": bundle.encoder("crop"),
+        "soil_types_data": bundle.soil_types(),
+        "soil_profiles": bundle.soil_profiles(),
+        "price_model": bundle.price_model(),
+        "price_crop_enc": bundle.encoder("price_crop"),
+        "price_state_enc": bundle.encoder("price_state"),
+        "price_quantiles": bundle.price_quantiles(),
+        "lag_table": bundle.lag_table(),
+        "weather_table": bundle.weather_table(),
+        "weather_history": bundle.weather_history(),
+    }
+
+def _build_engines(loaded: dict, from_bundle: bool, engine: str) -> tuple:
+    """Pick the crop / price / quantile evaluators according to INFERENCE_ENGINE."""
+    if engine == "auto":
+        engine = "compiled" if from_bundle else "sklearn"
+    if from_bundle:
+        if engine != "compiled":
+            print("⚠️  The model bundle only ships compiled trees; using INFERENCE_ENGINE=compiled")
+        return "compiled", loaded["crop_model"], loaded["price_model"], loaded["price_quantiles"]
+    saved = loaded["price_quantiles"]
+    if engine == "compiled":
+        quantiles = None if saved is None else \
+            tree_engine.compile_quantiles(saved["models"], saved["quantiles"], saved["max_horizon"])
+        return ("compiled", tree_engine.compile_classifier(loaded["crop_model"], loaded["crop_scaler"]),
+                tree_engine.compile_regressor(loaded["price_model"]), quantiles)
+    quantiles = None if saved is None else \
+        tree_engine.SklearnQuantiles(saved["models"], saved["quantiles"], saved["max_horizon"])
+    return ("sklearn", tree_engine.SklearnClassifier(loaded["crop_model"], loaded["crop_scaler"]),
+            loaded["price_model"], quantiles)
+
+def _build_batch_engine(loaded: dict, models_dir: str, crop_engine, sklearn_batch_rows: int):
+    """Client-batch crop evaluator: batches above sklearn_batch_rows go to sklearn (0 = never).
+
+    Only compiled engines are routed. In bundle mode this imports sklearn and
+    unpickles crop_model.pkl, so it is opt-in and part of the measured load.
+    """
+    if sklearn_batch_rows <= 0 or not isinstance(crop_engine, tree_engine.FlatForestClassifier):
+        return crop_engine
+    model = loaded["crop_model"]
+    if isinstance(model, tree_engine.FlatForestClassifier):
+        model = loaded["load_sklearn_crop"](models_dir)
+    fallback = tree_engine.SklearnClassifier(model, loaded["crop_scaler"])
+    return tree_engine.RoutedClassifier(crop_engine, fallback, sklearn_batch_rows)
+
+def load_registry(models_dir: str, model_format: str = "auto", engine: str = "auto",
+                  sklearn_batch_rows: int = 0) -> ModelRegistry:
+    """Load every artifact in models_dir into a new ModelRegistry (raises on any failure)."""
+    start = time.perf_counter()
+    fingerprint = artifact_fingerprint(models_dir)
+    bundle_path = find_bundle(models_dir) if model_format != "pickle" else None
+    if model_format == "bundle" and bundle_path is None:
+        raise FileNotFoundError("MODEL_FORMAT=bundle but models/saved/bundle is missing")
+    loaded = _load_from_bundle(bundle_path) if bundle_path else _load_from_pickles(models_dir)
+    inference_engine, crop_engine, price_engine, price_quantiles = _build_engines(loaded, bool(bundle_path), engine)
+    crop_batch_engine = _build_batch_engine(loaded, models_dir, crop_engine, sklearn_batch_rows)
+
+    crop_names = tuple(str(c) for c in loaded["crop_encoder"].classes_)
+    soil_codes = _code_index(loaded["soil_encoder"])
+    # Score with the crop→soil map the model was trained with (soil_types.json)
+    crop_soil_map = (loaded["soil_types_data"] or {}).get("crop_soil_map") or soil_compat.CROP_SOIL_TYPES
+
+    return ModelRegistry(
+        version=loaded["version"] or fingerprint,
+        fingerprint=fingerprint,
+        source=loaded["source"],
+        load_ms=round((time.perf_counter() - start) * 1000, 1),
+        inference_engine=inference_engine,
+        crop_model=loaded["crop_model"],
+        crop_scaler=loaded["crop_scaler"],
+        state_encoder=loaded["state_encoder"],
+        soil_encoder=loaded["soil_encoder"],
+        crop_encoder=loaded["crop_encoder"],
+        price_model=loaded["price_model"],
+        price_crop_enc=loaded["price_crop_enc"],
+        price_state_enc=loaded["price_state_enc"],
+        soil_types_data=loaded["soil_types_data"],
+        soil_profiles=loaded["soil_profiles"],
+        crop_engine=crop_engine,
+        crop_batch_engine=crop_batch_engine,
+        price_engine=price_engine,
+        price_quantiles=price_quantiles,
+        crop_names=crop_names,
+        crop_soil_compat=soil_compat.compat_matrix(crop_names, list(soil_codes), crop_soil_map),
+        state_codes=_code_index(loaded["state_encoder"]),
+        soil_codes=soil_codes,
+        price_crop_codes=_code_index(loaded["price_crop_enc"]),
+        price_state_codes=_code_index(loaded["price_state_enc"]),
+        lag_table=loaded["lag_table"],
+        weather_table=loaded["weather_table"],
+        weather_history=loaded["weather_history"],
+    )
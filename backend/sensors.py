@@ -0,0 +1,195 @@
+"""
+Bulk sensor_readings ingestion (database/schema.sql).
+Readings arrive columnar (one JSON list per field) or as NDJSON rows and are
+written in chunks over a bounded SQLAlchemy connection pool: COPY on
+PostgreSQL, multi-row INSERTs elsewhere. Without DATABASE_URL a local
+SQLite file stands in so the write path runs in development and tests.
+"""
+import csv
+import datetime
+import io
+import os
+import uuid
+from typing import Annotated, Dict, Iterable, List, Optional
+
+from pydantic import BaseModel, Field, model_validator
+from sqlalchemy import (Column, DateTime, MetaData, Numeric, String, Table, create_engine,
+                        select)
+
+LOCAL_DB_PATH = os.path.join(os.path.dirname(__file__), "sensor_readings.sqlite3")
+MEASUREMENTS = ("nitrogen", "phosphorus", "potassium", "ph_level", "soil_moisture",
+                "temperature", "humidity")
+COLUMNS = ("user_id",) + MEASUREMENTS + ("recorded_at",)
+
+metadata = MetaData()
+
+sensor_readings = Table(
+    "sensor_readings", metadata,
+    Column("id", String(36), primary_key=True, default=lambda: str(uuid.uuid4())),
+    Column("user_id", String, nullable=False, index=True),
+    Column("nitrogen", Numeric(6, 2)),
+    Column("phosphorus", Numeric(6, 2)),
+    Column("potassium", Numeric(6, 2)),
+    Column("ph_level", Numeric(4, 2)),
+    Column("soil_moisture", Numeric(5, 2)),
+    Column("temperature", Numeric(5, 2)),
+    Column("humidity", Numeric(5, 2)),
+    Column("recorded_at", DateTime(timezone=True), index=True),
+)
+
+farm_profiles = Table(
+    "farm_profiles", metadata,
+    Column("user_id", String, primary_key=True),
+    Column("state", String, nullable=False),
+    Column("soil_type", String),
+)
+
+
+# ─── Request schemas ────────────────────────────────────────
+# Value ranges that fit the sensor_readings columns, so out-of-range input is a 422, not a failed COPY
+Nutrient = Annotated[float, Field(ge=0, le=9999.99, allow_inf_nan=False)]       # Numeric(6, 2)
+PhLevel = Annotated[float, Field(ge=0, le=14, allow_inf_nan=False)]             # Numeric(4, 2)
+Percent = Annotated[float, Field(ge=0, le=100, allow_inf_nan=False)]            # Numeric(5, 2)
+Temperature = Annotated[float, Field(ge=-99.99, le=999.99, allow_inf_nan=False)]  # Numeric(5, 2)
+
+
+class SensorReading(BaseModel):
+    """One NDJSON line."""
+    user_id: str = Field(min_length=1)
+    nitrogen: Optional[Nutrient] = None
+    phosphorus: Optional[Nutrient] = None
+    potassium: Optional[Nutrient] = None
+    ph_level: Optional[PhLevel] = None
+    soil_moisture: Optional[Percent] = None
+    temperature: Optional[Temperature] = None
+    humidity: Optional[Percent] = None
+    recorded_at: Optional[datetime.datetime] = None
+
+
+class SensorReadingsBatch(BaseModel):
+    """Columnar batch: one list per field, all the same length. Missing columns are NULL."""
+    user_id: List[str]
+    nitrogen: Optional[List[Optional[Nutrient]]] = None
+    phosphorus: Optional[List[Optional[Nutrient]]] = None
+    potassium: Optional[List[Optional[Nutrient]]] = None
+    ph_level: Optional[List[Optional[PhLevel]]] = None
+    soil_moisture: Optional[List[Optional[Percent]]] = None
+    temperature: Optional[List[Optional[Temperature]]] = None
+    humidity: Optional[List[Optional[Percent]]] = None
+    recorded_at: Optional[List[Optional[datetime.datetime]]] = None
+
+    @model_validator(mode="after")
+    def check_lengths(self):
+        n = len(self.user_id)
+        if any(not u for u in self.user_id):
+            raise ValueError("user_id must be non-empty")
+        for name in COLUMNS[1:]:
+            values = getattr(self, name)
+            if values is not None and len(values) != n:
+                raise ValueError(f"column '{name}' has {len(values)} values, expected {n}")
+        return self
+
+    def columns(self) -> Dict[str, list]:
+        n = len(self.user_id)
+        return {name: (getattr(self, name) or [None] * n) for name in COLUMNS}
+
+
+def stamp_missing(cols: Dict[str, list], now: Optional[datetime.datetime] = None) -> Dict[str, list]:
+    """Readings without recorded_at are stamped with the ingest time (UTC)."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return dict(cols, recorded_at=[ts or now for ts in cols["recorded_at"]])
+
+
+def rows_to_columns(rows: Iterable[SensorReading]) -> Dict[str, list]:
+    cols = {name: [] for name in COLUMNS}
+    for row in rows:
+        for name in COLUMNS:
+            cols[name].append(getattr(row, name))
+    return cols
+
+
+# ─── Store ──────────────────────────────────────────────────
+class SensorStore:
+    def __init__(self, database_url: Optional[str] = None, pool_size: int = 4, max_overflow: int = 0,
+                 pool_timeout: float = 5.0):
+        self.local = not database_url
+        url = database_url or f"sqlite:///{LOCAL_DB_PATH}"
+        if self.local:
+            self.engine = create_engine(url)
+            metadata.create_all(self.engine)
+        else:
+            self.engine = create_engine(url, pool_size=pool_size, max_overflow=max_overflow,
+                                        pool_timeout=pool_timeout, pool_pre_ping=True)
+        self.dialect = self.engine.dialect.name
+
+    def write(self, cols: Dict[str, list]) -> int:
+        """Insert one columnar chunk in a single transaction; returns rows written."""
+        n = len(cols["user_id"])
+        if n == 0:
+            return 0
+        cols = stamp_missing(cols)
+        if self.dialect == "postgresql":
+            self._copy(cols, n)
+        else:
+            rows = [{name: cols[name][i] for name in COLUMNS} for i in range(n)]
+            with self.engine.begin() as conn:
+                conn.execute(sensor_readings.insert(), rows)
+        return n
+
+    def _copy(self, cols: Dict[str, list], n: int):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for i in range(n):
+            writer.writerow(["" if cols[name][i] is None else
+                             (cols[name][i].isoformat() if name == "recorded_at" else cols[name][i])
+                             for name in COLUMNS])
+        buf.seek(0)
+        raw = self.engine.raw_connection()
+        try:
+            with raw.cursor() as cur:
+                cur.copy_expert(f"COPY sensor_readings ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf)
+            raw.commit()
+        except Exception:
+            raw.rollback()
+            raise
+        finally:
+            raw.close()
+
+    def profiles(self, user_ids: List[str]) -> Dict[str, tuple]:
+        """user_id -> (state, soil_type) from farm_profiles."""
+        if not user_ids:
+            return {}
+        query = select(farm_profiles.c.user_id, farm_profiles.c.state, farm_profiles.c.soil_type) \
+            .where(farm_profiles.c.user_id.in_(user_ids))
+        with self.engine.connect() as conn:
+            return {row.user_id: (row.state, row.soil_type) for row in conn.execute(query)}
+
+    def dispose(self):
+        self.engine.dispose()
+
+
+def column_chunks(cols: Dict[str, list], size: int) -> Iterable[Dict[str, list]]:
+    n = len(cols["user_id"])
+    for start in range(0, n, size):
+        yield {name: values[start:start + size] for name, values in cols.items()}
+
+
+def latest_per_user(cols: Dict[str, list], latest: Optional[Dict[str, dict]] = None) -> Dict[str, dict]:
+    """Most recent complete reading per user (all fields the crop model needs present).
+
+    Readings without recorded_at count as taken now, as SensorStore.write stores
+    them; pass cols through stamp_missing() first so both see the same instant.
+    Pass the previous result as `latest` to fold in further chunks of a stream.
+    """
+    needed = ("nitrogen", "phosphorus", "potassium", "temperature", "ph_level", "soil_moisture")
+    latest = {} if latest is None else latest
+    cols = stamp_missing(cols)
+    for i, user in enumerate(cols["user_id"]):
+        if any(cols[name][i] is None for name in needed):
+            continue
+        ts = cols["recorded_at"][i]
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=datetime.timezone.utc)
+        if user not in latest or ts >= latest[user]["_ts"]:
+            latest[user] = {"_ts": ts, **{name: cols[name][i] for name in needed}}
+    return latest
@@ -0,0 +1,87 @@
+"""
+Crop × soil compatibility shared by train_models.py and main.py.
+CROP_SOIL_TYPES is compiled once into a dense (crop code × soil code) matrix
+aligned with crop_encoder / soil_encoder, so training samples and served
+recommendations look scores up with the same weights and re-rank whole
+probability matrices in a few array ops.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Maps crop → compatible soil types, best first (from agricultural knowledge)
+CROP_SOIL_TYPES = {
+    "Rice":       ["Clay", "Clay Loam", "Silty Clay", "Silty Loam"],
+    "Wheat":      ["Loamy", "Clay Loam", "Sandy Loam", "Black Cotton"],
+    "Maize":      ["Loamy", "Sandy Loam", "Sandy", "Clay Loam"],
+    "Cotton":     ["Black Cotton", "Clay Loam", "Sandy Clay", "Loamy"],
+    "Sugarcane":  ["Loamy", "Clay Loam", "Silty Loam", "Sandy Loam"],
+    "Soybean":    ["Loamy", "Sandy Loam", "Clay Loam", "Silty Loam"],
+    "Groundnut":  ["Sandy Loam", "Sandy", "Loamy", "Red Soil"],
+    "Pulses":     ["Sandy Loam", "Loamy", "Clay Loam", "Red Soil"],
+    "Millets":    ["Sandy", "Sandy Loam", "Loamy", "Red Soil"],
+    "Vegetables": ["Loamy", "Silty Loam", "Sandy Loam", "Clay Loam"],
+}
+
+ALL_SOIL_TYPES = sorted(set(st for soils in CROP_SOIL_TYPES.values() for st in soils))
+
+RANK_WEIGHTS = (1.0, 0.9)   # 1st / 2nd listed soil; later listed soils get SECONDARY
+SECONDARY = 0.75
+INCOMPATIBLE = 0.3
+
+
+def compat_matrix(crops: Sequence[str], soils: Sequence[str],
+                  crop_soil_map: Optional[Dict[str, List[str]]] = None) -> np.ndarray:
+    """Score for every crop code × soil code, plus a trailing column for unknown soils.
+
+    1.0 best match, 0.9 second, 0.75 other listed soils, 0.3 incompatible.
+    """
+    crop_soil_map = CROP_SOIL_TYPES if crop_soil_map is None else crop_soil_map
+    soil_col = {str(s): j for j, s in enumerate(soils)}
+    matrix = np.full((len(crops), len(soils) + 1), INCOMPATIBLE)
+    for i, crop in enumerate(crops):
+        for rank, soil in enumerate(crop_soil_map.get(str(crop), [])):
+            if soil in soil_col:
+                matrix[i, soil_col[soil]] = RANK_WEIGHTS[rank] if rank < len(RANK_WEIGHTS) else SECONDARY
+    matrix.flags.writeable = False
+    return matrix
+
+
+def soil_columns(soil_types: Sequence[str], soil_codes: Dict[str, int]) -> np.ndarray:
+    """Matrix column per requested soil; unknown soils map to the trailing (incompatible) column."""
+    unknown = len(soil_codes)
+    return np.array([soil_codes.get(s, unknown) for s in soil_types], dtype=np.intp)
+
+
+def boost(proba, compat):
+    """Model probability re-weighted by soil compatibility."""
+    return proba * (0.5 + 0.5 * compat)
+
+
+def rerank(proba: np.ndarray, matrix: np.ndarray, soil_cols: np.ndarray, pool: int,
+           top_k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Re-rank a whole (n_rows, n_crops) probability matrix.
+
+    Takes the top `pool` crops by probability per row, boosts them by soil
+    compatibility and keeps the best `top_k`. Ties keep probability order.
+    Returns (crop codes, boosted probabilities, compat scores), each (n_rows, top_k).
+    """
+    pool = min(pool, proba.shape[1])
+    cand = np.argpartition(-proba, pool - 1, axis=1)[:, :pool]
+    cand_prob = np.take_along_axis(proba, cand, axis=1)
+    order = np.argsort(-cand_prob, axis=1, kind="stable")
+    cand = np.take_along_axis(cand, order, axis=1)
+    cand_prob = np.take_along_axis(cand_prob, order, axis=1)
+
+    compat = matrix[cand, np.asarray(soil_cols)[:, None]]
+    boosted = boost(cand_prob, compat)
+    order = np.argsort(-boosted, axis=1, kind="stable")[:, :top_k]
+    return (np.take_along_axis(cand, order, axis=1),
+            np.take_along_axis(boosted, order, axis=1),
+            np.take_along_axis(compat, order, axis=1))
+
+
+def match_label(compat: float) -> str:
+    if compat >= RANK_WEIGHTS[0]:
+        return "✅ Best Match"
+    return "✓ Compatible" if compat >= SECONDARY else "⚠ Sub-optimal"
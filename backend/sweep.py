@@ -0,0 +1,67 @@
+"""
+What-if sweeps over the crop recommender.
+A base field plus value grids for some of its inputs is expanded into one
+feature matrix (every combination), scored in fixed-size predict_proba
+chunks and re-ranked exactly like /api/recommend-crops, so a whole
+sensitivity study is a few vectorized evaluations instead of hundreds of
+round trips.
+"""
+from typing import Dict, Optional
+
+import numpy as np
+
+import metrics
+import soil_compat
+
+# Sweepable inputs -> column in the (n, 9) crop feature matrix (see main._crop_features)
+FEATURE_COLUMNS = {"N": 0, "P": 1, "K": 2, "temperature": 3, "pH": 4, "moisture": 5}
+CHUNK_ROWS = 2048   # grid points per predict_proba call; bounds the engine's working memory
+
+
+def expand_grid(base: np.ndarray, axes: Dict[str, np.ndarray]) -> np.ndarray:
+    """Every combination of the axis values ("ij" order), other features from base."""
+    mesh = np.meshgrid(*axes.values(), indexing="ij")
+    features = np.repeat(np.asarray(base, dtype=float)[None, :], mesh[0].size, axis=0)
+    for name, values in zip(axes, mesh):
+        features[:, FEATURE_COLUMNS[name]] = values.ravel()
+    return features
+
+
+def score_grid(engine, matrix: np.ndarray, features: np.ndarray, soil_col: int, pool: int):
+    """Boosted probabilities (n, n_crops) and the served top pick per grid point, CHUNK_ROWS points per predict."""
+    boosted = np.empty((len(features), matrix.shape[0]))
+    top = np.empty(len(features), dtype=np.intp)
+    for start in range(0, len(features), CHUNK_ROWS):
+        chunk = features[start:start + CHUNK_ROWS]
+        with metrics.stage("sweep_predict_proba"):
+            proba = np.asarray(engine.predict_proba(chunk))
+        with metrics.stage("sweep_rerank"):
+            soil_cols = np.full(len(chunk), soil_col, dtype=np.intp)
+            top[start:start + len(chunk)] = soil_compat.rerank(proba, matrix, soil_cols, pool, 1)[0][:, 0]
+            boosted[start:start + len(chunk)] = soil_compat.boost(proba, matrix[:, soil_col])
+    return boosted, top
+
+
+def minimal_change(axes: Dict[str, np.ndarray], base: Dict[str, float], top: np.ndarray,
+                   target: int) -> Optional[dict]:
+    """Grid point nearest the base values at which `target` is the top pick.
+
+    Distance is the sum of each input's absolute change divided by its swept
+    span, so a 10 kg/ha N change and a 0.1 pH change are comparable. None if
+    the target never comes out on top inside the grid.
+    """
+    hits = np.flatnonzero(top == target)
+    if not len(hits):
+        return None
+    idx = np.unravel_index(hits, tuple(len(v) for v in axes.values()))
+    cost = np.zeros(len(hits))
+    for (name, values), i in zip(axes.items(), idx):
+        span = float(values.max() - values.min()) or 1.0
+        cost += np.abs(values[i] - base[name]) / span
+    best = int(np.argmin(cost))
+    point = {name: float(values[i[best]]) for (name, values), i in zip(axes.items(), idx)}
+    return {
+        "index": int(hits[best]),
+        "values": point,
+        "changes": {name: round(value - base[name], 6) for name, value in point.items()},
+    }
@@ -0,0 +1,123 @@
+"""
+Dense columnar lookup tables for the price lag cache and the weather lookup.
+train_models.py writes each table as float32 .npy arrays indexed directly by
+code: lag values by (price crop code, price state code), weather values by
+(weather state code, month). NaN marks a missing pair. Serving loads them
+with mmap_mode="r", so uvicorn workers on one host share the pages and a
+lookup is one array index instead of a pandas / dict probe.
+"""
+import os
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+LAG_COLUMNS = ("avg_price_rs_quintal", "lag1", "lag3", "lag6", "lag12")
+WEATHER_COLUMNS = ("avg_temp", "avg_rainfall", "avg_humidity", "avg_wind",
+                   "recent_temp", "recent_rainfall", "recent_humidity")
+LAG_FILES = ("price_lag.values.npy",)
+WEATHER_FILES = ("weather.states.npy", "weather.values.npy")
+
+
+def _first_present(present: np.ndarray, axis: int) -> np.ndarray:
+    """Index of the first True along axis, -1 where there is none."""
+    return np.where(present.any(axis=axis), present.argmax(axis=axis), -1).astype(np.int32)
+
+
+class LagTable:
+    """(crop code, state code) -> (base_price, lag1, lag3, lag6, lag12).
+
+    Pairs without their own row fall back to the crop's first cached state,
+    matching the original "first row per crop" lookup.
+    """
+
+    def __init__(self, values: np.ndarray):
+        self.values = values                                  # (n_crops, n_states, 5) float32, NaN = missing
+        self.present = ~np.isnan(values[..., 0])
+        self.fallback = _first_present(self.present, axis=1)  # (n_crops,) state code or -1
+
+    @classmethod
+    def from_rows(cls, crop_codes, state_codes, values, n_crops: int, n_states: int) -> "LagTable":
+        table = np.full((n_crops, n_states, len(LAG_COLUMNS)), np.nan, dtype=np.float32)
+        table[np.asarray(crop_codes), np.asarray(state_codes)] = np.asarray(values, dtype=np.float32)
+        return cls(table)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "LagTable":
+        return cls(np.load(os.path.join(directory, LAG_FILES[0]), mmap_mode="r" if mmap else None))
+
+    def save(self, directory: str):
+        np.save(os.path.join(directory, LAG_FILES[0]), np.ascontiguousarray(self.values, dtype=np.float32))
+
+    def resolve(self, crop_codes, state_codes) -> np.ndarray:
+        """State code to read per pair (own row or the crop's fallback); -1 if the crop has no rows."""
+        crop_codes, state_codes = np.asarray(crop_codes), np.asarray(state_codes)
+        return np.where(self.present[crop_codes, state_codes], state_codes, self.fallback[crop_codes])
+
+    def lags(self, crop_code: int, state_code: Optional[int]) -> Optional[tuple]:
+        """Lags for one pair; state_code None (unknown state) goes straight to the crop's fallback."""
+        if state_code is None or not self.present[crop_code, state_code]:
+            state_code = int(self.fallback[crop_code])
+        return None if state_code < 0 else tuple(float(v) for v in self.values[crop_code, state_code])
+
+    def gather(self, crop_codes, state_codes) -> Tuple[np.ndarray, np.ndarray]:
+        """(n, 5) float64 lags for n pairs with fallback, and a mask of pairs that resolved."""
+        crop_codes = np.asarray(crop_codes)
+        states = self.resolve(crop_codes, state_codes)
+        found = states >= 0
+        return self.values[crop_codes[found], states[found]].astype(np.float64), found
+
+    def pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(crop codes, state codes) of every cached pair, crop-major."""
+        return np.nonzero(self.present)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.values.nbytes)
+
+    def __len__(self):
+        return int(self.present.sum())
+
+
+class WeatherTable:
+    """(state, month) -> WEATHER_COLUMNS; unseen states fall back to the first state with that month."""
+
+    def __init__(self, states: Sequence[str], values: np.ndarray):
+        self.states = states                                  # weather state vocabulary, sorted
+        self.codes = {str(s): i for i, s in enumerate(states)}
+        self.values = values                                  # (n_states, 12, 7) float32, NaN = missing
+        self.present = ~np.isnan(values).all(axis=2)
+        self.fallback = _first_present(self.present, axis=0)  # (12,) state code or -1
+
+    @classmethod
+    def from_rows(cls, states, months, values) -> "WeatherTable":
+        vocab = sorted(set(str(s) for s in states))
+        codes = {s: i for i, s in enumerate(vocab)}
+        table = np.full((len(vocab), 12, len(WEATHER_COLUMNS)), np.nan, dtype=np.float32)
+        table[[codes[str(s)] for s in states], np.asarray(months) - 1] = np.asarray(values, dtype=np.float32)
+        return cls(vocab, table)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "WeatherTable":
+        states = np.load(os.path.join(directory, WEATHER_FILES[0])).tolist()
+        values = np.load(os.path.join(directory, WEATHER_FILES[1]), mmap_mode="r" if mmap else None)
+        return cls(states, values)
+
+    def save(self, directory: str):
+        np.save(os.path.join(directory, WEATHER_FILES[0]), np.asarray(self.states, dtype=str))
+        np.save(os.path.join(directory, WEATHER_FILES[1]), np.ascontiguousarray(self.values, dtype=np.float32))
+
+    def row(self, state: str, month: int) -> Optional[np.ndarray]:
+        """WEATHER_COLUMNS values for (state, month); None for an invalid month or no data."""
+        if not 1 <= month <= 12:
+            return None
+        code = self.codes.get(state)
+        if code is None or not self.present[code, month - 1]:
+            code = int(self.fallback[month - 1])
+        return None if code < 0 else self.values[code, month - 1]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.values.nbytes)
+
+    def __len__(self):
+        return int(self.present.sum())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend modules are imported flat (import tree_engine), as main.py does
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,106 @@
+"""Compiled tree evaluators must reproduce sklearn's outputs."""
+import numpy as np
+import pytest
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestClassifier
+from sklearn.preprocessing import StandardScaler
+
+import tree_engine
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    X = np.column_stack([rng.uniform(0, 140, 3000), rng.uniform(5, 45, 3000), rng.uniform(4, 9, 3000),
+                         rng.integers(0, 20, 3000), rng.uniform(0.2, 1.0, 3000)])
+    y = (X[:, 0] // 35 + (X[:, 2] > 6.5) * 4 + X[:, 3] % 3).astype(int)
+    return X[:2000], y[:2000], X[2000:]
+
+
+@pytest.fixture(scope="module")
+def scaled_forest(data):
+    X, y, _ = data
+    scaler = StandardScaler().fit(X)
+    clf = RandomForestClassifier(n_estimators=25, max_depth=10, random_state=0).fit(scaler.transform(X), y)
+    return clf, scaler
+
+
+def split_points(clf, scaler):
+    """Raw rows sitting exactly on split thresholds, where float32 rounding decides the branch."""
+    rows = []
+    for tree in clf.estimators_[:5]:
+        t = tree.tree_
+        for node in np.flatnonzero(t.children_left != tree_engine.TREE_LEAF)[:40]:
+            scaled = np.zeros(len(scaler.mean_))
+            scaled[t.feature[node]] = t.threshold[node]
+            rows.append(scaler.inverse_transform(scaled[None, :])[0])
+    return np.array(rows)
+
+
+def assert_parity(expected, actual):
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-12)
+    assert tree_engine.check_parity(expected, actual)["mismatch_rate"] == 0
+
+
+def test_classifier_without_scaler(data):
+    X, y, X_test = data
+    clf = RandomForestClassifier(n_estimators=25, max_depth=10, random_state=0).fit(X, y)
+    assert_parity(clf.predict_proba(X_test), tree_engine.compile_classifier(clf).predict_proba(X_test))
+
+
+def test_classifier_with_scaler(data, scaled_forest):
+    _, _, X_test = data
+    clf, scaler = scaled_forest
+    compiled = tree_engine.compile_classifier(clf, scaler)
+    assert_parity(clf.predict_proba(scaler.transform(X_test)), compiled.predict_proba(X_test))
+
+
+def test_classifier_with_scaler_on_split_thresholds(scaled_forest):
+    clf, scaler = scaled_forest
+    rows = split_points(clf, scaler)
+    compiled = tree_engine.compile_classifier(clf, scaler)
+    assert_parity(clf.predict_proba(scaler.transform(rows)), compiled.predict_proba(rows))
+
+
+def test_classifier_spans_chunks(data, scaled_forest):
+    _, _, X_test = data
+    clf, scaler = scaled_forest
+    rows = np.tile(X_test, (2, 1))[:tree_engine.CHUNK_ROWS * 2 + 7]
+    compiled = tree_engine.compile_classifier(clf, scaler)
+    assert_parity(clf.predict_proba(scaler.transform(rows)), compiled.predict_proba(rows))
+    assert compiled.predict_proba(rows[:0]).shape == (0, len(clf.classes_))
+
+
+def test_boosting_regressor(data):
+    X, _, X_test = data
+    target = X[:, 0] * 3 + np.sin(X[:, 1]) * 50 + X[:, 2] ** 2
+    model = GradientBoostingRegressor(n_estimators=40, max_depth=4, random_state=0).fit(X, target)
+    expected = model.predict(X_test)
+    np.testing.assert_allclose(tree_engine.compile_regressor(model).predict(X_test), expected, rtol=1e-12)
+
+
+def test_quantile_regressor(data):
+    X, _, X_test = data
+    target = X[:, 0] + np.random.default_rng(1).normal(0, 10, len(X))
+    quantiles = (0.1, 0.5, 0.9)
+    models = [GradientBoostingRegressor(loss="quantile", alpha=q, n_estimators=20, max_depth=3,
+                                        random_state=0).fit(X, target) for q in quantiles]
+    expected = tree_engine.SklearnQuantiles(models, quantiles).predict(X_test)
+    compiled = tree_engine.compile_quantiles(models, quantiles).predict(X_test)
+    np.testing.assert_allclose(compiled, expected, rtol=1e-12)
+
+
+def test_routed_classifier_sends_large_batches_to_fallback(data, scaled_forest):
+    _, _, X_test = data
+    clf, scaler = scaled_forest
+    calls = []
+
+    class Spy(tree_engine.SklearnClassifier):
+        def predict_proba(self, X):
+            calls.append(len(X))
+            return super().predict_proba(X)
+
+    routed = tree_engine.RoutedClassifier(tree_engine.compile_classifier(clf, scaler), Spy(clf, scaler), max_rows=10)
+    assert_parity(clf.predict_proba(scaler.transform(X_test[:10])), routed.predict_proba(X_test[:10]))
+    assert not calls
+    assert_parity(clf.predict_proba(scaler.transform(X_test)), routed.predict_proba(X_test))
+    assert calls == [len(X_test)]
@@ -1,8 +1,18 @@
 """
 train_models.py - Train all ML models from dataset CSVs and save as .pkl files
-Run once: python train_models.py
+Run: python train_models.py [--samples-per-combo 15] [--seed 42] [--force]
+                            [--stages crop,price,weather,weather_history,soil]
+
+Each stage is keyed by a hash of its input CSVs and hyperparameters and
+recorded in models/saved/manifest.json; unchanged stages are skipped and
+stale ones run in parallel processes.
 """
+import argparse
+import hashlib
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import joblib
@@ -10,186 +20,517 @@ from sklearn.ensemble import RandomForestClassifier, GradientBoostingRegressor
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, mean_absolute_error
+import forecast
+import soil_compat
+import tree_engine
+from bundle import BUNDLE_FORMAT, export_bundle, find_bundle
+from soil_compat import ALL_SOIL_TYPES, CROP_SOIL_TYPES
+import weather_history
+from tables import LAG_COLUMNS, LAG_FILES, WEATHER_COLUMNS, WEATHER_FILES, LagTable, WeatherTable
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), '..')
 MODELS_DIR = os.path.join(os.path.dirname(__file__), 'models', 'saved')
-os.makedirs(MODELS_DIR, exist_ok=True)
-
-print("=" * 60)
-print("CROP ADVISOR SYSTEM — ML MODEL TRAINER")
-print("=" * 60)
-
-# ─── Soil type compatibility table ──────────────────────────
-# Maps crop → compatible soil types (from agricultural knowledge)
-CROP_SOIL_TYPES = {
-    "Rice":       ["Clay", "Clay Loam", "Silty Clay", "Silty Loam"],
-    "Wheat":      ["Loamy", "Clay Loam", "Sandy Loam", "Black Cotton"],
-    "Maize":      ["Loamy", "Sandy Loam", "Sandy", "Clay Loam"],
-    "Cotton":     ["Black Cotton", "Clay Loam", "Sandy Clay", "Loamy"],
-    "Sugarcane":  ["Loamy", "Clay Loam", "Silty Loam", "Sandy Loam"],
-    "Soybean":    ["Loamy", "Sandy Loam", "Clay Loam", "Silty Loam"],
-    "Groundnut":  ["Sandy Loam", "Sandy", "Loamy", "Red Soil"],
-    "Pulses":     ["Sandy Loam", "Loamy", "Clay Loam", "Red Soil"],
-    "Millets":    ["Sandy", "Sandy Loam", "Loamy", "Red Soil"],
-    "Vegetables": ["Loamy", "Silty Loam", "Sandy Loam", "Clay Loam"],
-}
-
-ALL_SOIL_TYPES = sorted(set(st for soils in CROP_SOIL_TYPES.values() for st in soils))
-
-def soil_compatibility_score(crop: str, soil: str) -> float:
-    """Returns 1.0 if best match, 0.75 if secondary, 0.3 if incompatible."""
-    soils = CROP_SOIL_TYPES.get(crop, [])
-    if not soils or soil not in soils:
-        return 0.3   # incompatible
-    idx = soils.index(soil)
-    if idx == 0: return 1.0
-    if idx == 1: return 0.9
-    return 0.75     # secondary match
+MANIFEST_PATH = os.path.join(MODELS_DIR, 'manifest.json')
+
+def generate_crop_samples(df_crops: pd.DataFrame, soils: list, per_combo: int,
+                          rng: np.random.Generator) -> pd.DataFrame:
+    """Draw per_combo samples for every crop×state row × soil type in a few array ops."""
+    n_rows, n_soils = len(df_crops), len(soils)
+    crops = pd.Categorical(df_crops['crop_name'])
+    compat = soil_compat.compat_matrix(crops.categories, soils)[crops.codes, :n_soils]
+    # Sample order matches the old nested loop: row → soil → sample
+    row_idx = np.repeat(np.arange(n_rows), n_soils * per_combo)
+    soil_idx = np.tile(np.repeat(np.arange(n_soils), per_combo), n_rows)
+    compat = compat[row_idx, soil_idx]
+    n_noise = np.maximum(compat, 0.5)
+
+    def bounds(col):
+        return df_crops[col].to_numpy(dtype=float)[row_idx]
+
+    return pd.DataFrame({
+        'N': rng.uniform(bounds('ideal_n') * 0.7 * n_noise, bounds('ideal_n') * 1.3),
+        'P': rng.uniform(bounds('ideal_p') * 0.7 * n_noise, bounds('ideal_p') * 1.3),
+        'K': rng.uniform(bounds('ideal_k') * 0.7 * n_noise, bounds('ideal_k') * 1.3),
+        'temperature': rng.uniform(bounds('temp_min_c'), bounds('temp_max_c')),
+        'pH': rng.uniform(bounds('ph_min'), bounds('ph_max')),
+        'moisture': rng.uniform(bounds('soil_moisture_min'), bounds('soil_moisture_max')),
+        'state': df_crops['state'].to_numpy()[row_idx],
+        'soil_type': np.asarray(soils, dtype=object)[soil_idx],
+        'soil_compat': compat,
+        'crop': df_crops['crop_name'].to_numpy()[row_idx],
+    })
 
 # ===========================================================
 # 1. CROP RECOMMENDATION MODEL — RandomForestClassifier
 # ===========================================================
-print("\n[1/3] Training Crop Recommendation Model (with soil_type)...")
-
-df_crops = pd.read_csv(os.path.join(DATA_DIR, 'crops_india_master.csv'))
-print(f"  Loaded {len(df_crops)} rows from crops_india_master.csv")
-
-records = []
-for _, row in df_crops.iterrows():
-    for soil in ALL_SOIL_TYPES:
-        compat = soil_compatibility_score(row['crop_name'], soil)
-        # Generate 15 synthetic samples per crop×state×soil
-        for _ in range(15):
-            n_noise = compat if compat > 0.5 else 0.5
-            n = np.random.uniform(row['ideal_n'] * 0.7 * n_noise, row['ideal_n'] * 1.3)
-            p = np.random.uniform(row['ideal_p'] * 0.7 * n_noise, row['ideal_p'] * 1.3)
-            k = np.random.uniform(row['ideal_k'] * 0.7 * n_noise, row['ideal_k'] * 1.3)
-            temp = np.random.uniform(row['temp_min_c'], row['temp_max_c'])
-            ph = np.random.uniform(row['ph_min'], row['ph_max'])
-            moisture = np.random.uniform(row['soil_moisture_min'], row['soil_moisture_max'])
-            records.append({
-                'N': n, 'P': p, 'K': k,
-                'temperature': temp,
-                'pH': ph,
-                'moisture': moisture,
-                'state': row['state'],
-                'soil_type': soil,
-                'soil_compat': compat,
-                'crop': row['crop_name']
-            })
-
-df_train = pd.DataFrame(records)
-print(f"  Generated {len(df_train):,} training samples (state × crop × soil_type combinations)")
-
-# Encode categoricals
-state_enc  = LabelEncoder()
-soil_enc   = LabelEncoder()
-crop_enc   = LabelEncoder()
-df_train['state_enc']     = state_enc.fit_transform(df_train['state'])
-df_train['soil_type_enc'] = soil_enc.fit_transform(df_train['soil_type'])
-df_train['crop_enc']      = crop_enc.fit_transform(df_train['crop'])
-
-features = ['N', 'P', 'K', 'temperature', 'pH', 'moisture', 'state_enc', 'soil_type_enc', 'soil_compat']
-X = df_train[features].values
-y = df_train['crop_enc'].values
-
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-scaler_crop = StandardScaler()
-X_train_s   = scaler_crop.fit_transform(X_train)
-X_test_s    = scaler_crop.transform(X_test)
-
-clf = RandomForestClassifier(n_estimators=200, max_depth=15, random_state=42, n_jobs=-1)
-clf.fit(X_train_s, y_train)
-y_pred = clf.predict(X_test_s)
-acc = accuracy_score(y_test, y_pred)
-print(f"  ✓ RandomForest accuracy: {acc:.2%}")
-
-# Save encoders and model
-joblib.dump(clf,          os.path.join(MODELS_DIR, 'crop_model.pkl'))
-joblib.dump(scaler_crop,  os.path.join(MODELS_DIR, 'crop_scaler.pkl'))
-joblib.dump(state_enc,    os.path.join(MODELS_DIR, 'state_encoder.pkl'))
-joblib.dump(soil_enc,     os.path.join(MODELS_DIR, 'soil_encoder.pkl'))
-joblib.dump(crop_enc,     os.path.join(MODELS_DIR, 'crop_encoder.pkl'))
-
-# Save soil types list for frontend
-import json
-with open(os.path.join(MODELS_DIR, 'soil_types.json'), 'w') as f:
-    json.dump({"soil_types": ALL_SOIL_TYPES, "crop_soil_map": CROP_SOIL_TYPES}, f, indent=2)
-print(f"  ✓ Soil types saved: {ALL_SOIL_TYPES}")
+def train_crop_model(params: dict) -> dict:
+    print("\n[crop] Training Crop Recommendation Model (with soil_type)...")
+
+    df_crops = pd.read_csv(os.path.join(DATA_DIR, 'crops_india_master.csv'))
+    print(f"  [crop] Loaded {len(df_crops)} rows from crops_india_master.csv")
+
+    df_train = generate_crop_samples(df_crops, ALL_SOIL_TYPES, params['samples_per_combo'],
+                                     np.random.default_rng(params['seed']))
+    print(f"  [crop] Generated {len(df_train):,} training samples (state × crop × soil_type combinations)")
+
+    # Encode categoricals
+    state_enc  = LabelEncoder()
+    soil_enc   = LabelEncoder()
+    crop_enc   = LabelEncoder()
+    df_train['state_enc']     = state_enc.fit_transform(df_train['state'])
+    df_train['soil_type_enc'] = soil_enc.fit_transform(df_train['soil_type'])
+    df_train['crop_enc']      = crop_enc.fit_transform(df_train['crop'])
+
+    features = ['N', 'P', 'K', 'temperature', 'pH', 'moisture', 'state_enc', 'soil_type_enc', 'soil_compat']
+    X = df_train[features].values
+    y = df_train['crop_enc'].values
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    scaler_crop = StandardScaler()
+    X_train_s   = scaler_crop.fit_transform(X_train)
+    X_test_s    = scaler_crop.transform(X_test)
+
+    clf = RandomForestClassifier(n_estimators=params['n_estimators'], max_depth=params['max_depth'],
+                                 random_state=42, n_jobs=-1)
+    clf.fit(X_train_s, y_train)
+    y_pred = clf.predict(X_test_s)
+    acc = accuracy_score(y_test, y_pred)
+    print(f"  [crop] ✓ RandomForest accuracy: {acc:.2%}")
+
+    # Serving parity: compiled forest (scaler included) vs sklearn on the held-out split
+    parity = tree_engine.check_parity(clf.predict_proba(X_test_s),
+                                      tree_engine.compile_classifier(clf, scaler_crop).predict_proba(X_test))
+    print(f"  [crop] ✓ Compiled evaluator parity: {parity}")
+
+    # Save encoders and model
+    joblib.dump(clf,          os.path.join(MODELS_DIR, 'crop_model.pkl'))
+    joblib.dump(scaler_crop,  os.path.join(MODELS_DIR, 'crop_scaler.pkl'))
+    joblib.dump(state_enc,    os.path.join(MODELS_DIR, 'state_encoder.pkl'))
+    joblib.dump(soil_enc,     os.path.join(MODELS_DIR, 'soil_encoder.pkl'))
+    joblib.dump(crop_enc,     os.path.join(MODELS_DIR, 'crop_encoder.pkl'))
+
+    # Save soil types list for frontend
+    with open(os.path.join(MODELS_DIR, 'soil_types.json'), 'w') as f:
+        json.dump({"soil_types": ALL_SOIL_TYPES, "crop_soil_map": CROP_SOIL_TYPES}, f, indent=2)
+    print(f"  [crop] ✓ Soil types saved: {ALL_SOIL_TYPES}")
+    return {"accuracy": round(float(acc), 4), "samples": len(df_train), "parity": parity}
 
 # ===========================================================
 # 2. MARKET PRICE PREDICTION MODEL — GradientBoosting
 # ===========================================================
-print("\n[2/3] Training Market Price Prediction Model...")
-
-df_prices = pd.read_csv(os.path.join(DATA_DIR, 'crop_prices_india_monthly_1975_2025.csv'))
-print(f"  Loaded {len(df_prices):,} rows from crop_prices_india_monthly_1975_2025.csv")
-
-df_prices['year']  = df_prices['date'].str[:4].astype(int)
-df_prices['month'] = df_prices['date'].str[5:7].astype(int)
-df_prices = df_prices.sort_values(['crop_name', 'state', 'date'])
-
-df_prices['lag1']  = df_prices.groupby(['crop_name', 'state'])['avg_price_rs_quintal'].shift(1)
-df_prices['lag3']  = df_prices.groupby(['crop_name', 'state'])['avg_price_rs_quintal'].shift(3)
-df_prices['lag6']  = df_prices.groupby(['crop_name', 'state'])['avg_price_rs_quintal'].shift(6)
-df_prices['lag12'] = df_prices.groupby(['crop_name', 'state'])['avg_price_rs_quintal'].shift(12)
-df_prices = df_prices.dropna()
-
-price_crop_enc  = LabelEncoder()
-price_state_enc = LabelEncoder()
-df_prices['crop_enc']  = price_crop_enc.fit_transform(df_prices['crop_name'])
-df_prices['state_enc'] = price_state_enc.fit_transform(df_prices['state'])
-
-price_features = ['crop_enc', 'state_enc', 'year', 'month', 'lag1', 'lag3', 'lag6', 'lag12']
-X_p = df_prices[price_features].values
-y_p = df_prices['avg_price_rs_quintal'].values
+def train_price_model(params: dict) -> dict:
+    print("\n[price] Training Market Price Prediction Model...")
+
+    df_prices = pd.read_csv(os.path.join(DATA_DIR, 'crop_prices_india_monthly_1975_2025.csv'))
+    print(f"  [price] Loaded {len(df_prices):,} rows from crop_prices_india_monthly_1975_2025.csv")
+
+    df_prices['year']  = df_prices['date'].str[:4].astype(int)
+    df_prices['month'] = df_prices['date'].str[5:7].astype(int)
+    df_prices = df_prices.sort_values(['crop_name', 'state', 'date'])
+
+    df_prices['lag1']  = df_prices.groupby(['crop_name', 'state'])['avg_price_rs_quintal'].shift(1)
+    df_prices['lag3']  = df_prices.groupby(['crop_name', 'state'])['avg_price_rs_quintal'].shift(3)
+    df_prices['lag6']  = df_prices.groupby(['crop_name', 'state'])['avg_price_rs_quintal'].shift(6)
+    df_prices['lag12'] = df_prices.groupby(['crop_name', 'state'])['avg_price_rs_quintal'].shift(12)
+    df_prices = df_prices.dropna()
+
+    price_crop_enc  = LabelEncoder()
+    price_state_enc = LabelEncoder()
+    df_prices['crop_enc']  = price_crop_enc.fit_transform(df_prices['crop_name'])
+    df_prices['state_enc'] = price_state_enc.fit_transform(df_prices['state'])
+
+    price_features = ['crop_enc', 'state_enc', 'year', 'month', 'lag1', 'lag3', 'lag6', 'lag12']
+    X_p = df_prices[price_features].values
+    y_p = df_prices['avg_price_rs_quintal'].values
+
+    X_p_train, X_p_test, y_p_train, y_p_test = train_test_split(X_p, y_p, test_size=0.15, random_state=42)
+
+    price_model = GradientBoostingRegressor(n_estimators=params['n_estimators'], max_depth=params['max_depth'],
+                                            learning_rate=params['learning_rate'], random_state=42)
+    price_model.fit(X_p_train, y_p_train)
+    mae = mean_absolute_error(y_p_test, price_model.predict(X_p_test))
+    print(f"  [price] ✓ GradientBoosting MAE: ₹{mae:.0f}/quintal")
+
+    parity = tree_engine.check_parity(price_model.predict(X_p_test),
+                                      tree_engine.compile_regressor(price_model).predict(X_p_test),
+                                      atol=1e-6)
+    print(f"  [price] ✓ Compiled evaluator parity: {parity}")
+
+    joblib.dump(price_model,     os.path.join(MODELS_DIR, 'price_model.pkl'))
+    joblib.dump(price_crop_enc,  os.path.join(MODELS_DIR, 'price_crop_encoder.pkl'))
+    joblib.dump(price_state_enc, os.path.join(MODELS_DIR, 'price_state_encoder.pkl'))
+
+    # Latest row per (crop, state) as a dense float32 table indexed by the price encoder codes
+    lag_cache = df_prices.groupby(['crop_enc', 'state_enc']).last()[list(LAG_COLUMNS)].reset_index()
+    lag_table = LagTable.from_rows(lag_cache['crop_enc'], lag_cache['state_enc'], lag_cache[list(LAG_COLUMNS)],
+                                   len(price_crop_enc.classes_), len(price_state_enc.classes_))
+    lag_table.save(MODELS_DIR)
+    print(f"  [price] ✓ Price model saved (lag table: {len(lag_table)} pairs, {lag_table.nbytes / 1024:.0f} KiB)")
+
+    quantile_metrics = train_price_quantiles(df_prices, params)
+    return {"mae": round(float(mae), 2), "parity": parity, "quantiles": quantile_metrics}
+
+def horizon_training_set(df_prices: pd.DataFrame, max_horizon: int) -> tuple:
+    """Direct multi-horizon rows: features at month t, target price(t+h) / price(t), h = 1..max_horizon.
+
+    df_prices must be sorted by crop, state, date with one row per month.
+    """
+    price = df_prices['avg_price_rs_quintal'].to_numpy(float)
+    lags = df_prices[['avg_price_rs_quintal', 'lag1', 'lag3', 'lag6', 'lag12']].to_numpy(float)
+    groups = df_prices.groupby(['crop_name', 'state'], sort=False)
+    X, y = [], []
+    for h in range(1, max_horizon + 1):
+        future = groups['avg_price_rs_quintal'].shift(-h).to_numpy(float)
+        ok = ~np.isnan(future) & (price > 0)
+        X.append(forecast.horizon_features(
+            df_prices['crop_enc'].to_numpy()[ok], df_prices['state_enc'].to_numpy()[ok],
+            (df_prices['month'].to_numpy()[ok] - 1 + h) % 12 + 1, np.full(ok.sum(), h), lags[ok]))
+        y.append(future[ok] / price[ok])
+    return np.vstack(X), np.concatenate(y)
+
+def train_price_quantiles(df_prices: pd.DataFrame, params: dict) -> dict:
+    """P10/P50/P90 (params['quantiles']) GradientBoosting models over all horizons at once."""
+    X, y = horizon_training_set(df_prices, params['max_horizon'])
+    rng = np.random.default_rng(42)
+    if len(y) > params['quantile_rows']:
+        keep = rng.choice(len(y), params['quantile_rows'], replace=False)
+        X, y = X[keep], y[keep]
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.15, random_state=42)
+
+    models = []
+    for q in params['quantiles']:
+        model = GradientBoostingRegressor(loss='quantile', alpha=q, n_estimators=params['quantile_estimators'],
+                                          max_depth=params['quantile_depth'],
+                                          subsample=params['quantile_subsample'],
+                                          learning_rate=params['learning_rate'], random_state=42)
+        model.fit(X_train, y_train)
+        models.append(model)
+
+    reference = tree_engine.SklearnQuantiles(models, params['quantiles'], params['max_horizon'])
+    compiled = tree_engine.compile_quantiles(models, params['quantiles'], params['max_horizon'])
+    predicted = reference.predict(X_test)
+    parity = tree_engine.check_parity(predicted, compiled.predict(X_test), atol=1e-6)
+    coverage = {forecast.quantile_label(q): round(float((y_test <= predicted[:, j]).mean()), 4)
+                for j, q in enumerate(params['quantiles'])}
+    print(f"  [price] ✓ Quantile models {params['quantiles']} × {params['max_horizon']} horizons, "
+          f"test coverage {coverage}")
+
+    joblib.dump({"quantiles": list(params['quantiles']), "max_horizon": params['max_horizon'], "models": models},
+                os.path.join(MODELS_DIR, 'price_quantile_models.pkl'))
+    return {"rows": int(len(y)), "coverage": coverage, "parity": parity}
 
-X_p_train, X_p_test, y_p_train, y_p_test = train_test_split(X_p, y_p, test_size=0.15, random_state=42)
+# ===========================================================
+# 3. WEATHER ANALYSIS — Historical averages by state+month
+# ===========================================================
+WEATHER_CHUNK_ROWS = 500_000
+WEATHER_MEASURES = {  # CSV column -> (all-years output, recent-window output or None)
+    'avg_temp_c': ('avg_temp', 'recent_temp'),
+    'rainfall_mm': ('avg_rainfall', 'recent_rainfall'),
+    'humidity_pct': ('avg_humidity', 'recent_humidity'),
+    'wind_speed_mps': ('avg_wind', None),
+}
 
-price_model = GradientBoostingRegressor(n_estimators=200, max_depth=6, learning_rate=0.1, random_state=42)
-price_model.fit(X_p_train, y_p_train)
-mae = mean_absolute_error(y_p_test, price_model.predict(X_p_test))
-print(f"  ✓ GradientBoosting MAE: ₹{mae:.0f}/quintal")
+def _year_month(dates: pd.Series):
+    """Year and month from 'YYYY-MM[-DD]' strings without per-row string slicing."""
+    digits = np.asarray(dates.to_numpy(), dtype='U7').view(np.uint32).reshape(-1, 7).astype(np.int16) - ord('0')
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = (digits[:, 5] * 10 + digits[:, 6]).astype(np.int8)
+    return year, month
+
+def aggregate_weather(path: str, recent_since: int, chunk_rows: int = WEATHER_CHUNK_ROWS) -> pd.DataFrame:
+    """Per (state, month) means over all years and over year >= recent_since, in one chunked pass.
+
+    Only running sums and non-null counts per (state, month) are kept, so
+    memory is bounded by the number of states, not by the input size
+    (monthly state data or daily district data alike).
+    """
+    measures = list(WEATHER_MEASURES)
+    states: dict = {}                                  # state name -> dense code
+    size = 0
+    rows = np.zeros(0, dtype=np.int64)                 # rows seen per (state, month) key
+    sums = np.zeros((2, len(measures), 0))             # [all|recent, measure, key]
+    counts = np.zeros((2, len(measures), 0), dtype=np.int64)
+
+    reader = pd.read_csv(path, usecols=['date', 'state'] + measures, chunksize=chunk_rows,
+                         dtype={'date': str, 'state': 'category', **{m: np.float32 for m in measures}})
+    for chunk in reader:
+        chunk = chunk[chunk['state'].notna()]
+        for name in chunk['state'].cat.categories:
+            states.setdefault(name, len(states))
+        if len(states) * 13 > size:
+            grow = len(states) * 13 - size
+            rows = np.concatenate([rows, np.zeros(grow, dtype=np.int64)])
+            sums = np.concatenate([sums, np.zeros((2, len(measures), grow))], axis=2)
+            counts = np.concatenate([counts, np.zeros((2, len(measures), grow), dtype=np.int64)], axis=2)
+            size = len(states) * 13
+
+        remap = np.array([states[name] for name in chunk['state'].cat.categories], dtype=np.int64)
+        year, month = _year_month(chunk['date'])
+        key = remap[chunk['state'].cat.codes.to_numpy()] * 13 + month
+        recent = year >= recent_since
+        rows += np.bincount(key, minlength=size)
+        for j, m in enumerate(measures):
+            values = chunk[m].to_numpy(np.float64)
+            valid = ~np.isnan(values)
+            for w, mask in enumerate((valid, valid & recent)):
+                sums[w, j] += np.bincount(key[mask], weights=values[mask], minlength=size)
+                counts[w, j] += np.bincount(key[mask], minlength=size)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    keys = np.array([states[name] * 13 + month for name in sorted(states) for month in range(1, 13)],
+                    dtype=np.int64)
+    keys = keys[rows[keys] > 0]
+    out = pd.DataFrame({'state': np.array(list(states), dtype=object)[keys // 13], 'month': keys % 13})
+    for j, (all_col, _) in enumerate(WEATHER_MEASURES.values()):
+        out[all_col] = means[0, j, keys]
+    for j, (_, recent_col) in enumerate(WEATHER_MEASURES.values()):
+        if recent_col:
+            out[recent_col] = means[1, j, keys]
+    return out
+
+def build_weather_lookup(params: dict) -> dict:
+    print("\n[weather] Building Weather Lookup Table...")
+
+    weather_full = aggregate_weather(os.path.join(DATA_DIR, 'weather_india_monthly_1975_2025.csv'),
+                                     params['recent_since'])
+    table = WeatherTable.from_rows(weather_full['state'], weather_full['month'],
+                                   weather_full.reindex(columns=list(WEATHER_COLUMNS)))
+    table.save(MODELS_DIR)
+    print(f"  [weather] ✓ Weather lookup: {len(table)} state×month combinations ({table.nbytes / 1024:.0f} KiB)")
+    return {"rows": len(table)}
+
+def aggregate_weather_history(path: str, columns: list, chunk_rows: int = WEATHER_CHUNK_ROWS) -> pd.DataFrame:
+    """Per (state, month index) means of columns, in one chunked pass.
+
+    Running sums and non-null counts are merged after every chunk, so memory
+    is bounded by the number of state-months in the output, not by the input
+    size (daily / district-level inputs collapse to one row per state and month).
+    """
+    totals = None
+    reader = pd.read_csv(path, usecols=['date', 'state'] + columns, chunksize=chunk_rows,
+                         dtype={'date': str, 'state': 'category', **{c: np.float32 for c in columns}})
+    for chunk in reader:
+        chunk = chunk[chunk['state'].notna()]
+        year, month = _year_month(chunk['date'])
+        keys = [chunk['state'].astype(object),
+                pd.Series(year.astype(np.int32) * 12 + month - 1, index=chunk.index, name='month_index')]
+        grouped = chunk[columns].astype(np.float64).groupby(keys)
+        part = pd.concat({'sum': grouped.sum(), 'count': grouped.count()}, axis=1)
+        totals = part if totals is None else totals.add(part, fill_value=0)
+
+    if totals is None:
+        return pd.DataFrame(columns=['state', 'month_index'] + columns)
+    return (totals['sum'] / totals['count'].where(totals['count'] > 0)).reset_index()
+
+def build_weather_history(params: dict) -> dict:
+    """Full monthly series as a state-partitioned, date-sorted float32 store (weather_history.py)."""
+    print("\n[weather_history] Building Weather History Store...")
+
+    columns = list(weather_history.MEASURES.values())
+    monthly = aggregate_weather_history(os.path.join(DATA_DIR, 'weather_india_monthly_1975_2025.csv'), columns)
+    store = weather_history.WeatherHistory.from_rows(monthly['state'], monthly['month_index'], monthly[columns])
+    store.save(MODELS_DIR)
+    print(f"  [weather_history] ✓ {len(store):,} state-months for {len(store.states)} states "
+          f"({store.nbytes / 1024:.0f} KiB)")
+    return {"rows": len(store)}
 
-joblib.dump(price_model,     os.path.join(MODELS_DIR, 'price_model.pkl'))
-joblib.dump(price_crop_enc,  os.path.join(MODELS_DIR, 'price_crop_encoder.pkl'))
-joblib.dump(price_state_enc, os.path.join(MODELS_DIR, 'price_state_encoder.pkl'))
+# ===========================================================
+# 4. SOIL PROFILES — Representative nutrients by state
+# ===========================================================
+SOIL_PROFILE_RANGES = {  # profile field -> (min column, max column) in soil_npk_india_dataset.csv
+    'N': ('nitrogen_kg_ha_min', 'nitrogen_kg_ha_max'),
+    'P': ('phosphorus_kg_ha_min', 'phosphorus_kg_ha_max'),
+    'K': ('potassium_kg_ha_min', 'potassium_kg_ha_max'),
+    'pH': ('ph_min', 'ph_max'),
+    'moisture': ('soil_moisture_min_pct', 'soil_moisture_max_pct'),
+}
 
-lag_cache = df_prices.groupby(['crop_name', 'state']).last()[
-    ['lag1','lag3','lag6','lag12','avg_price_rs_quintal']
-].reset_index()
-lag_cache.to_csv(os.path.join(MODELS_DIR, 'price_lag_cache.csv'), index=False)
-print(f"  ✓ Price model saved")
+def build_soil_profiles(params: dict) -> dict:
+    """Per-state midpoints of the soil survey ranges, averaged over the state's soil classes."""
+    print("\n[soil] Building Soil Profiles...")
+
+    df_soil = pd.read_csv(os.path.join(DATA_DIR, 'soil_npk_india_dataset.csv'))
+    mids = pd.DataFrame({field: (df_soil[lo] + df_soil[hi]) / 2 for field, (lo, hi) in SOIL_PROFILE_RANGES.items()})
+    by_state = mids.groupby(df_soil['state']).mean().round(2)
+    profiles = {
+        "national": mids.mean().round(2).to_dict(),
+        "states": {state: row.to_dict() for state, row in by_state.iterrows()},
+    }
+    with open(os.path.join(MODELS_DIR, 'soil_profiles.json'), 'w') as f:
+        json.dump(profiles, f, indent=2)
+    print(f"  [soil] ✓ Soil profiles: {len(by_state)} states from {len(df_soil)} survey rows")
+    return {"states": len(by_state)}
 
 # ===========================================================
-# 3. WEATHER ANALYSIS — Historical averages by state+month
+# Stage graph, content hashing and manifest
 # ===========================================================
-print("\n[3/3] Building Weather Lookup Table...")
-
-df_weather = pd.read_csv(os.path.join(DATA_DIR, 'weather_india_monthly_1975_2025.csv'))
-df_weather['month'] = df_weather['date'].str[5:7].astype(int)
-df_weather['year']  = df_weather['date'].str[:4].astype(int)
-
-weather_avg = df_weather.groupby(['state', 'month']).agg(
-    avg_temp=('avg_temp_c', 'mean'),
-    avg_rainfall=('rainfall_mm', 'mean'),
-    avg_humidity=('humidity_pct', 'mean'),
-    avg_wind=('wind_speed_mps', 'mean')
-).reset_index()
-
-recent = df_weather[df_weather['year'] >= 2020]
-weather_recent = recent.groupby(['state', 'month']).agg(
-    recent_temp=('avg_temp_c', 'mean'),
-    recent_rainfall=('rainfall_mm', 'mean'),
-    recent_humidity=('humidity_pct', 'mean'),
-).reset_index()
-
-weather_full = weather_avg.merge(weather_recent, on=['state', 'month'], how='left')
-weather_full.to_csv(os.path.join(MODELS_DIR, 'weather_lookup.csv'), index=False)
-print(f"  ✓ Weather lookup: {len(weather_full)} state×month combinations")
-
-print("\n" + "=" * 60)
-print("✅ ALL MODELS TRAINED SUCCESSFULLY!")
-print(f"   Saved to: {MODELS_DIR}")
-print("=" * 60)
+# Bump a stage's "version" when its code changes in a way that affects outputs.
+STAGES = {
+    "crop": {
+        "fn": train_crop_model,
+        "version": 1,
+        "inputs": ["crops_india_master.csv"],
+        "outputs": ["crop_model.pkl", "crop_scaler.pkl", "state_encoder.pkl", "soil_encoder.pkl",
+                    "crop_encoder.pkl", "soil_types.json"],
+    },
+    "price": {
+        "fn": train_price_model,
+        "version": 3,
+        "inputs": ["crop_prices_india_monthly_1975_2025.csv"],
+        "outputs": ["price_model.pkl", "price_crop_encoder.pkl", "price_state_encoder.pkl",
+                    "price_quantile_models.pkl", *LAG_FILES],
+    },
+    "weather": {
+        "fn": build_weather_lookup,
+        "version": 3,
+        "inputs": ["weather_india_monthly_1975_2025.csv"],
+        "outputs": list(WEATHER_FILES),
+    },
+    "weather_history": {
+        "fn": build_weather_history,
+        "version": 1,
+        "inputs": ["weather_india_monthly_1975_2025.csv"],
+        "outputs": list(weather_history.FILES),
+    },
+    "soil": {
+        "fn": build_soil_profiles,
+        "version": 1,
+        "inputs": ["soil_npk_india_dataset.csv"],
+        "outputs": ["soil_profiles.json"],
+    },
+}
+
+def stage_params(args) -> dict:
+    return {
+        "crop": {"samples_per_combo": args.samples_per_combo, "seed": args.seed,
+                 "n_estimators": 200, "max_depth": 15, "soil_types": CROP_SOIL_TYPES,
+                 "soil_weights": [*soil_compat.RANK_WEIGHTS, soil_compat.SECONDARY, soil_compat.INCOMPATIBLE]},
+        "price": {"n_estimators": 200, "max_depth": 6, "learning_rate": 0.1,
+                  "quantiles": [0.1, 0.5, 0.9], "max_horizon": forecast.MAX_HORIZON, "quantile_rows": 40_000,
+                  "quantile_estimators": 150, "quantile_depth": 5, "quantile_subsample": 0.5},
+        "weather": {"recent_since": args.recent_since},
+        "weather_history": {},
+        "soil": {},
+    }
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def stage_key(name: str, params: dict) -> str:
+    """Hash of the stage's input files, hyperparameters and code version."""
+    stage = STAGES[name]
+    h = hashlib.sha256()
+    h.update(json.dumps({"stage": name, "version": stage["version"], "params": params},
+                        sort_keys=True).encode())
+    for filename in stage["inputs"]:
+        h.update(filename.encode())
+        h.update(file_digest(os.path.join(DATA_DIR, filename)).encode())
+    return h.hexdigest()
+
+def load_manifest() -> dict:
+    if not os.path.exists(MANIFEST_PATH):
+        return {"stages": {}}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+def save_manifest(manifest: dict):
+    tmp = MANIFEST_PATH + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, MANIFEST_PATH)
+
+def is_up_to_date(name: str, key: str, manifest: dict) -> bool:
+    entry = manifest["stages"].get(name)
+    if not entry or entry.get("key") != key:
+        return False
+    return all(os.path.exists(os.path.join(MODELS_DIR, out)) for out in STAGES[name]["outputs"])
+
+def run_stage(name: str, params: dict) -> dict:
+    start = time.perf_counter()
+    metrics = STAGES[name]["fn"](params)
+    return {"metrics": metrics, "seconds": round(time.perf_counter() - start, 2)}
+
+def build_bundle(manifest: dict, force: bool):
+    """Export the fast-start serving bundle once every stage has trained artifacts."""
+    missing = [name for name in STAGES if name not in manifest["stages"]]
+    if missing:
+        print(f"  ↷ bundle: skipped, stages never trained: {', '.join(missing)}")
+        return
+    h = hashlib.sha256(f"bundle-format-{BUNDLE_FORMAT}".encode())
+    for name in sorted(STAGES):
+        h.update(manifest["stages"][name]["key"].encode())
+    key = h.hexdigest()
+    if not force and manifest.get("bundle", {}).get("key") == key and find_bundle(MODELS_DIR):
+        print("  ↷ bundle: up to date")
+        return
+    start = time.perf_counter()
+    path = export_bundle(MODELS_DIR, version=key)
+    manifest["bundle"] = {"key": key, "seconds": round(time.perf_counter() - start, 2)}
+    save_manifest(manifest)
+    print(f"  ✓ Serving bundle written to {path}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train Crop Advisor ML models")
+    parser.add_argument("--samples-per-combo", type=int, default=15,
+                        help="synthetic crop-model samples per crop×state×soil_type row (default: 15)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for synthetic sample generation")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="comma-separated stages to consider (default: all)")
+    parser.add_argument("--recent-since", type=int, default=2020,
+                        help="first year of the 'recent' weather window (default: 2020)")
+    parser.add_argument("--force", action="store_true", help="retrain even if inputs are unchanged")
+    parser.add_argument("--jobs", type=int, default=len(STAGES),
+                        help="max stages trained in parallel (1 = sequential)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(MODELS_DIR, exist_ok=True)
+
+    print("=" * 60)
+    print("CROP ADVISOR SYSTEM — ML MODEL TRAINER")
+    print("=" * 60)
+
+    selected = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(selected) - set(STAGES)
+    if unknown:
+        raise SystemExit(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    params = stage_params(args)
+    manifest = load_manifest()
+    keys, stale = {}, []
+    for name in selected:
+        keys[name] = stage_key(name, params[name])
+        if not args.force and is_up_to_date(name, keys[name], manifest):
+            print(f"  ↷ {name}: inputs unchanged, skipping")
+        else:
+            stale.append(name)
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(stale)))) as pool:
+            futures = {name: pool.submit(run_stage, name, params[name]) for name in stale}
+            for name, future in futures.items():
+                result = future.result()
+                manifest["stages"][name] = {
+                    "key": keys[name],
+                    "outputs": STAGES[name]["outputs"],
+                    "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    **result,
+                }
+                save_manifest(manifest)
+
+    build_bundle(manifest, args.force)
+
+    print("\n" + "=" * 60)
+    print("✅ ALL MODELS TRAINED SUCCESSFULLY!" if stale else "✅ ALL MODELS UP TO DATE")
+    print(f"   Saved to: {MODELS_DIR}")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
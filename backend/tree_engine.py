@@ -0,0 +1,247 @@
+"""
+Pure-NumPy evaluator for the trained tree ensembles.
+Forests are converted to flat node arrays (feature, threshold, left, right,
+value) and evaluated level by level for all trees at once, a chunk of rows
+at a time, skipping sklearn's per-call validation and dispatch. The crop
+model's StandardScaler travels with the forest and is applied exactly as
+sklearn applies it, so outputs match sklearn's bit for bit up to summation
+order. The traversal wins on per-call overhead but not on throughput;
+RoutedClassifier can send large client batches to sklearn instead.
+"""
+import numpy as np
+
+TREE_LEAF = -1
+CHUNK_ROWS = 512   # rows per traversal; bounds the (rows × trees) node-index arrays
+
+
+class FlatForest:
+    """Tree ensemble stored as flat node arrays with global child indices.
+
+    Leaves have feature == -1. Rows are standardized with (mean, scale) when
+    given, then cast to float32 and compared against the original float64
+    thresholds — the same arithmetic as scaler.transform + tree.predict.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, mean=None, scale=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float64)
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float64)
+
+    def prepare(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64)
+        if self.mean is not None:
+            X = (X - self.mean) / self.scale
+        return X.astype(np.float32)
+
+    def chunks(self, X):
+        """(start, leaves) per CHUNK_ROWS rows; leaves is (rows, n_trees) leaf node indexes."""
+        X = self.prepare(X)
+        for start in range(0, len(X), CHUNK_ROWS):
+            yield start, self.leaves(X[start:start + CHUNK_ROWS])
+
+    def leaves(self, X) -> np.ndarray:
+        """(n_rows, n_trees) leaf node index reached by every row of a prepared float32 X in every tree."""
+        n_rows, n_features = X.shape
+        n_trees = len(self.roots)
+        flat_x = X.ravel()
+        node = np.tile(self.roots, n_rows)
+        row_base = np.repeat(np.arange(n_rows, dtype=np.intp) * n_features, n_trees)
+        active = np.arange(n_rows * n_trees)
+        while len(active):
+            current = node[active]
+            feat = self.feature[current]
+            internal = feat >= 0
+            if not internal.all():   # drop paths that reached a leaf
+                active, current, feat = active[internal], current[internal], feat[internal]
+            go_left = flat_x[row_base[active] + feat] <= self.threshold[current]
+            node[active] = np.where(go_left, self.left[current], self.right[current])
+        return node.reshape(n_rows, n_trees)
+
+
+class FlatForestClassifier(FlatForest):
+    """RandomForestClassifier.predict_proba: mean of per-tree normalized leaf distributions."""
+
+    def predict_proba(self, X) -> np.ndarray:
+        out = np.zeros((len(X), self.value.shape[1]))
+        for start, leaves in self.chunks(X):
+            acc = out[start:start + len(leaves)]
+            for tree in range(leaves.shape[1]):   # tree by tree, like sklearn: no (rows × trees × classes) array
+                acc += self.value[leaves[:, tree]]
+        out /= len(self.roots)
+        return out
+
+
+class FlatBoostingRegressor(FlatForest):
+    """GradientBoostingRegressor.predict: init + learning_rate × sum of leaf values."""
+
+    def __init__(self, *arrays, init: float = 0.0, learning_rate: float = 0.1, **kwargs):
+        super().__init__(*arrays, **kwargs)
+        self.init = init
+        self.learning_rate = learning_rate
+
+    def predict(self, X) -> np.ndarray:
+        sums = np.zeros(len(X))
+        for start, leaves in self.chunks(X):
+            sums[start:start + len(leaves)] = self.value[leaves].sum(axis=1)
+        return self.init + self.learning_rate * sums
+
+
+class FlatQuantileRegressor(FlatForest):
+    """Several GradientBoostingRegressor(loss="quantile") models evaluated in one traversal.
+
+    The models' trees are concatenated; starts[j] is the first tree of quantile j.
+    predict returns (n_rows, n_quantiles), columns sorted so quantiles never cross.
+    """
+
+    def __init__(self, *arrays, quantiles=(), starts=(), init=(), learning_rate=(), max_horizon: int = 12,
+                 **kwargs):
+        super().__init__(*arrays, **kwargs)
+        self.quantiles = tuple(float(q) for q in quantiles)
+        self.starts = np.asarray(starts, dtype=np.intp)
+        self.init = np.asarray(init, dtype=np.float64)
+        self.learning_rate = np.asarray(learning_rate, dtype=np.float64)
+        self.max_horizon = int(max_horizon)
+
+    def predict(self, X) -> np.ndarray:
+        sums = np.zeros((len(X), len(self.starts)))
+        for start, leaves in self.chunks(X):
+            sums[start:start + len(leaves)] = np.add.reduceat(self.value[leaves], self.starts, axis=1)
+        return np.sort(self.init + self.learning_rate * sums, axis=1)
+
+
+class SklearnClassifier:
+    """Scaler + sklearn classifier behind the same raw-feature predict_proba interface."""
+
+    def __init__(self, model, scaler=None):
+        self.model = model
+        self.scaler = scaler
+
+    def predict_proba(self, X) -> np.ndarray:
+        if self.scaler is not None:
+            X = self.scaler.transform(X)
+        return self.model.predict_proba(X)
+
+
+class RoutedClassifier:
+    """Compiled forest for small inputs, an already-loaded sklearn classifier above max_rows."""
+
+    def __init__(self, compiled: FlatForestClassifier, fallback, max_rows: int):
+        self.compiled = compiled
+        self.fallback = fallback
+        self.max_rows = max_rows
+
+    def predict_proba(self, X) -> np.ndarray:
+        if len(X) > self.max_rows:
+            return np.asarray(self.fallback.predict_proba(X))
+        return self.compiled.predict_proba(X)
+
+
+class SklearnQuantiles:
+    """Per-quantile sklearn regressors behind the FlatQuantileRegressor interface."""
+
+    def __init__(self, models, quantiles, max_horizon: int = 12):
+        self.models = list(models)
+        self.quantiles = tuple(float(q) for q in quantiles)
+        self.max_horizon = int(max_horizon)
+
+    def predict(self, X) -> np.ndarray:
+        return np.sort(np.column_stack([m.predict(X) for m in self.models]), axis=1)
+
+
+# ─── Compilation ────────────────────────────────────────────
+def flatten_trees(trees, classifier: bool) -> dict:
+    """Concatenate sklearn Tree objects into flat node arrays with global child indices."""
+    cols = {"feature": [], "threshold": [], "left": [], "right": [], "value": []}
+    roots, offset = [], 0
+    for tree in trees:
+        t = tree.tree_
+        is_leaf = t.children_left == TREE_LEAF
+        cols["feature"].append(np.where(is_leaf, -1, t.feature).astype(np.int32))
+        cols["threshold"].append(t.threshold.astype(np.float64))
+        cols["left"].append(np.where(is_leaf, -1, t.children_left + offset).astype(np.int32))
+        cols["right"].append(np.where(is_leaf, -1, t.children_right + offset).astype(np.int32))
+        if classifier:
+            value = t.value[:, 0, :]
+            value = value / np.maximum(value.sum(axis=1, keepdims=True), 1e-12)
+        else:
+            value = t.value[:, 0, 0]
+        cols["value"].append(value.astype(np.float64))
+        roots.append(offset)
+        offset += t.node_count
+    arrays = {c: np.concatenate(v) for c, v in cols.items()}
+    arrays["roots"] = np.asarray(roots, dtype=np.int32)
+    return arrays
+
+
+def forest_arrays(model, classifier: bool) -> dict:
+    trees = model.estimators_ if classifier else model.estimators_[:, 0]
+    return flatten_trees(trees, classifier)
+
+
+def boosting_constants(model) -> dict:
+    init = model.init_
+    return {
+        "init": 0.0 if isinstance(init, str) else float(np.ravel(init.constant_)[0]),
+        "learning_rate": float(model.learning_rate),
+    }
+
+
+def compile_classifier(model, scaler=None) -> FlatForestClassifier:
+    """RandomForestClassifier (+ optional fitted StandardScaler, applied to raw rows) → FlatForestClassifier."""
+    arrays = forest_arrays(model, classifier=True)
+    if scaler is None:
+        return FlatForestClassifier(**arrays)
+    return FlatForestClassifier(**arrays, mean=scaler.mean_, scale=scaler.scale_)
+
+
+def compile_regressor(model) -> FlatBoostingRegressor:
+    """GradientBoostingRegressor → FlatBoostingRegressor."""
+    return FlatBoostingRegressor(**forest_arrays(model, classifier=False), **boosting_constants(model))
+
+
+def quantile_arrays(models) -> tuple:
+    """Flat node arrays for several boosting models plus per-model constants."""
+    arrays = flatten_trees([t for m in models for t in m.estimators_[:, 0]], classifier=False)
+    counts = [len(m.estimators_) for m in models]
+    constants = [boosting_constants(m) for m in models]
+    return arrays, {
+        "starts": np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.intp),
+        "init": [c["init"] for c in constants],
+        "learning_rate": [c["learning_rate"] for c in constants],
+    }
+
+
+def compile_quantiles(models, quantiles, max_horizon: int = 12) -> FlatQuantileRegressor:
+    """Quantile GradientBoostingRegressors (one per quantile) → FlatQuantileRegressor."""
+    arrays, constants = quantile_arrays(models)
+    return FlatQuantileRegressor(**arrays, quantiles=quantiles, max_horizon=max_horizon, **constants)
+
+
+# ─── Parity ─────────────────────────────────────────────────
+def check_parity(expected: np.ndarray, actual: np.ndarray, atol: float = 1e-9,
+                 max_mismatch_rate: float = 0.001) -> dict:
+    """Compare reference (sklearn) and compiled outputs row by row.
+
+    The compiled evaluators reproduce sklearn's arithmetic, so only summation
+    order differs; a tiny mismatch rate is tolerated, anything more raises.
+    """
+    expected = np.asarray(expected, dtype=np.float64)
+    actual = np.asarray(actual, dtype=np.float64)
+    diff = np.abs(expected - actual)
+    row_diff = diff.reshape(len(diff), -1).max(axis=1)
+    mismatch_rate = float((row_diff > atol).mean()) if len(row_diff) else 0.0
+    report = {
+        "rows": int(len(row_diff)),
+        "max_abs_diff": float(row_diff.max()) if len(row_diff) else 0.0,
+        "mismatch_rate": round(mismatch_rate, 6),
+    }
+    if expected.ndim == 2:
+        report["argmax_agreement"] = round(float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean()), 6)
+    if mismatch_rate > max_mismatch_rate:
+        raise AssertionError(f"Compiled model diverges from sklearn: {report}")
+    return report
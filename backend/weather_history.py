@@ -0,0 +1,148 @@
+"""
+Monthly weather history store.
+train_models.py converts weather_india_monthly_1975_2025.csv into
+state-partitioned, date-sorted columns:
+  weather_history.states.npy    sorted state vocabulary
+  weather_history.offsets.npy   rows offsets[i]:offsets[i + 1] belong to state i
+  weather_history.months.npy    int32 year * 12 + month - 1, ascending within each state
+  weather_history.values.npy    float32 (n_measures, n_rows); each measure contiguous
+The server memory-maps them. A query binary-searches one state's contiguous
+slice and computes rolling means, anomalies and percentile ranks on it with
+a handful of numpy calls; no pandas on the request path.
+"""
+import os
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+# API measure name -> CSV column
+MEASURES = {"temperature": "avg_temp_c", "rainfall": "rainfall_mm", "humidity": "humidity_pct",
+            "wind": "wind_speed_mps"}
+STATS = ("rolling", "anomaly", "yoy", "percentile")
+FILES = ("weather_history.states.npy", "weather_history.offsets.npy", "weather_history.months.npy",
+         "weather_history.values.npy")
+
+
+def parse_month(text: str) -> int:
+    """'YYYY-MM' -> month index (year * 12 + month - 1)."""
+    year, month = text.split("-")
+    year, month = int(year), int(month)
+    if not 1 <= month <= 12:
+        raise ValueError(f"invalid month in {text!r}")
+    return year * 12 + month - 1
+
+
+def format_months(months: np.ndarray) -> list:
+    return [f"{m // 12:04d}-{m % 12 + 1:02d}" for m in np.asarray(months).tolist()]
+
+
+def _json_values(values: np.ndarray, decimals: int = 2) -> list:
+    """Rounded floats with NaN as null (JSON has no NaN)."""
+    return [None if v != v else v for v in np.round(np.asarray(values, dtype=np.float64), decimals).tolist()]
+
+
+class WeatherHistory:
+    def __init__(self, states: Sequence[str], offsets: np.ndarray, months: np.ndarray, values: np.ndarray):
+        self.states = list(states)
+        self.codes = {str(s): i for i, s in enumerate(self.states)}
+        self.offsets = offsets
+        self.months = months
+        self.values = values
+
+    @classmethod
+    def from_rows(cls, states, months, values) -> "WeatherHistory":
+        """Sort rows by (state, month) and partition them; values is (n_rows, len(MEASURES))."""
+        vocab = sorted(set(str(s) for s in states))
+        lookup = {s: i for i, s in enumerate(vocab)}
+        codes = np.array([lookup[str(s)] for s in states], dtype=np.int64)
+        months = np.asarray(months, dtype=np.int32)
+        order = np.lexsort((months, codes))
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(vocab)))]).astype(np.int64)
+        return cls(vocab, offsets, months[order],
+                   np.ascontiguousarray(np.asarray(values, dtype=np.float32)[order].T))
+
+    @staticmethod
+    def available(directory: str) -> bool:
+        return all(os.path.exists(os.path.join(directory, name)) for name in FILES)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "WeatherHistory":
+        mode = "r" if mmap else None
+        states = np.load(os.path.join(directory, FILES[0])).tolist()
+        offsets, months, values = (np.load(os.path.join(directory, name), mmap_mode=mode) for name in FILES[1:])
+        return cls(states, offsets, months, values)
+
+    def save(self, directory: str):
+        arrays = (np.asarray(self.states, dtype=str), self.offsets, self.months, self.values)
+        for name, arr in zip(FILES, arrays):
+            np.save(os.path.join(directory, name), np.ascontiguousarray(arr))
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.months.nbytes + self.values.nbytes)
+
+    def __len__(self):
+        return len(self.months)
+
+    def query(self, state: str, start: Optional[int] = None, end: Optional[int] = None,
+              measures: Iterable[str] = tuple(MEASURES), stats: Iterable[str] = (),
+              window: int = 12) -> Optional[dict]:
+        """Columnar slice [start, end] (month indexes, inclusive) of one state, plus derived series.
+
+        rolling     trailing mean over `window` rows (months), reaching back before start
+        anomaly     value minus the state's mean for that calendar month over the full history
+        yoy         value minus the same month one year earlier
+        percentile  rank (0-100) among the state's values for that calendar month
+        """
+        code = self.codes.get(state)
+        if code is None:
+            return None
+        a, b = int(self.offsets[code]), int(self.offsets[code + 1])
+        months = self.months[a:b]
+        lo = int(np.searchsorted(months, start, "left")) if start is not None else 0
+        hi = int(np.searchsorted(months, end, "right")) if end is not None else len(months)
+        hi = max(hi, lo)
+        sel_months = np.asarray(months[lo:hi])
+        calendar = months % 12
+        sel_calendar = sel_months % 12
+
+        out = {"months": format_months(sel_months), "series": {}}
+        if "yoy" in stats:
+            prev = np.searchsorted(months, sel_months - 12)
+            prev_found = np.minimum(prev, len(months) - 1)
+            prev_found = np.where((prev < len(months)) & (months[prev_found] == sel_months - 12), prev_found, -1)
+        for name in measures:
+            full = self.values[list(MEASURES).index(name), a:b]
+            sel = np.asarray(full[lo:hi], dtype=np.float64)
+            series: Dict[str, list] = {"values": _json_values(sel)}
+            valid = ~np.isnan(full)
+            if "rolling" in stats:
+                first = max(lo - window + 1, 0)
+                seg = np.asarray(full[first:hi], dtype=np.float64)
+                seg_valid = ~np.isnan(seg)
+                sums = np.concatenate([[0.0], np.cumsum(np.where(seg_valid, seg, 0.0))])
+                counts = np.concatenate([[0], np.cumsum(seg_valid)])
+                ends = np.arange(lo - first + 1, len(seg) + 1)
+                starts = np.maximum(ends - window, 0)
+                n = counts[ends] - counts[starts]
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    series["rollingMean"] = _json_values(np.where(n > 0, (sums[ends] - sums[starts]) / n, np.nan))
+            if "anomaly" in stats:
+                totals = np.bincount(calendar[valid], weights=full[valid], minlength=12)
+                counts = np.bincount(calendar[valid], minlength=12)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    climatology = totals / counts
+                series["anomaly"] = _json_values(sel - climatology[sel_calendar])
+            if "yoy" in stats:
+                previous = np.where(prev_found >= 0, np.asarray(full, dtype=np.float64)[prev_found], np.nan)
+                series["yoy"] = _json_values(sel - previous)
+            if "percentile" in stats:
+                ranks = np.full(len(sel), np.nan)
+                for month in np.unique(sel_calendar):
+                    history = np.sort(full[valid & (calendar == month)])
+                    rows = np.flatnonzero((sel_calendar == month) & ~np.isnan(sel))
+                    if len(history):
+                        ranks[rows] = np.searchsorted(history, sel[rows], "right") / len(history) * 100
+                series["percentile"] = _json_values(ranks, 1)
+            out["series"][name] = series
+        return out
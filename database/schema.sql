@@ -73,7 +73,8 @@ CREATE TABLE IF NOT EXISTS market_predictions (
     phase3_price NUMERIC(10,2),   -- Days 31-45
     phase4_price NUMERIC(10,2),   -- Days 46-60
     predicted_at TIMESTAMPTZ DEFAULT NOW(),
-    UNIQUE(crop_name, state, DATE(predicted_at))
+    predicted_on DATE NOT NULL DEFAULT CURRENT_DATE,   -- one row per crop/state/day
+    UNIQUE(crop_name, state, predicted_on)
 );
 
 -- ─────────────────────────────────────────────